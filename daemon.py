@@ -0,0 +1,69 @@
+"""
+Headless refresh daemon
+
+Keeps the local price history up-to-date while the GUI is closed. The daemon holds the store lock,
+so a GUI started meanwhile only reads the shared store and never blocks on the network.
+
+    python daemon.py [--interval MINUTES] [--backend segments|sqlite] [--fiat CURRENCY]
+"""
+
+import argparse
+import os
+import signal
+import sys
+import threading
+
+from ingest.service import IngestService, get_app_path
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="SolWatcher headless refresh daemon")
+    parser.add_argument('--interval', type=float, default=5, help="minutes between two refreshes")
+    parser.add_argument('--backend', default=os.environ.get('SOLWATCHER_BACKEND', 'segments'),
+                        help="storage backend of price history ('segments' or 'sqlite')")
+    parser.add_argument('--fiat', action='append', default=None,
+                        help="currency whose exchange rate history is kept (repeatable, default czk, currencies "
+                             "requested by the GUI are kept too)")
+    args = parser.parse_args()
+    fiats = ['czk'] if args.fiat is None else args.fiat
+
+    app_path = get_app_path()
+    if app_path is None:
+        print("Unknown platform!")
+        return 100
+
+    stopped = threading.Event()
+
+    def stop(signum, frame):
+        print(f"Received signal {signum} -> stopping after current refresh")
+        stopped.set()
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+
+    service = IngestService(app_path, args.backend)
+
+    # GUI may be writing the store right now
+    while not service.acquire():
+        print("Store is written by another process -> waiting")
+        if stopped.wait(30):
+            return 0
+
+    try:
+        service.load()
+        service.update()
+        service.update_fx(fiats + service.fx.currencies())
+        service.start_live()
+        while not stopped.wait(args.interval * 60):
+            service.update()
+            # exchange rates of currencies the GUI displays
+            service.update_fx(fiats + service.fx.currencies())
+    finally:
+        service.release()
+        print("Refresh daemon stopped")
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,96 @@
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timezone
+import requests
+
+from ingest.planner import RESOLUTIONS, horizon, plan_fetches
+from store.gaps import coalesce, find_gaps
+
+# tier checked for gaps of given resolution
+GAP_TIERS = {'5m': 'raw', '1h': '1h', '1d': '1d'}
+
+
+class Backfill:
+    """
+    Historical download split into request windows by the fetch planner and fetched on a bounded thread pool
+
+    Every part of the interval gets the finest resolution the API serves for it with the fewest requests.
+    Window boundaries are aligned to whole days and hours, so repeated backfills request the same urls and
+    hit the response cache. Downloads are yielded as soon as they arrive, so they can be streamed into
+    the store. Global rate limit is kept by the request scheduler used by fetch.
+    """
+
+    def __init__(self, fetch, max_workers: int = 4):
+        """
+        Args:
+            fetch:          function(coin, fiat, time_s, time_e) -> DataFrame downloading one window
+            max_workers:    number of parallel downloads
+        """
+
+        self.fetch = fetch
+        self.max_workers: int = max_workers
+
+    @staticmethod
+    def find_missing(store, start: datetime, now: datetime = None) -> list:
+        """
+        Find spans missing in the store at the best resolution the API can still provide for them
+
+        The last day is checked in raw tier against 5 minute cadence, the last 90 days in hourly
+        tier and older history in daily tier. Neighbouring gaps of the same resolution are merged
+        while they fit into one request.
+
+        Args:
+            store:  HistoryStore backend
+            start:  start of the history (naive UTC)
+            now:    current time (None = now)
+
+        Out:
+            spans:  list of (start, end) tuples sorted by time
+        """
+
+        if now is None:
+            now = datetime.now(timezone.utc).replace(tzinfo=None)
+
+        spans = []
+        band_end = now
+        for resolution, (step, age, max_span) in RESOLUTIONS.items():
+            band_start = start if age is None else max(start, horizon(resolution, now))
+            if band_start < band_end:
+                df = store.range(GAP_TIERS[resolution], band_start, band_end)
+                times = None if df is None else df['time']
+                spans = coalesce(find_gaps(times, step, band_start, band_end), max_span) + spans
+            band_end = min(band_end, band_start)
+
+        return spans
+
+    def fill_batch(self, fiat: str, spans: dict, resolution: str = None):
+        """
+        Download spans of more coins in one pool, so the whole watchlist shares parallel downloads
+        and the rate limit
+
+        Args:
+            fiat:           name of currency to download price in
+            spans:          {coin: list of (start, end) tuples (naive UTC)}
+            resolution:     desired resolution ('5m', '1h', '1d' or None = the finest available)
+
+        Out:
+            iterator of (coin, downloaded DataFrame) tuples in order of completion
+        """
+
+        now = datetime.now(timezone.utc).replace(tzinfo=None)
+        windows = [(coin, window) for coin, coin_spans in spans.items()
+                   for start, end in coin_spans for window in plan_fetches(start, end, resolution, now)]
+        if len(windows) == 0:
+            return
+        print(f"Backfilling {len(spans)} coins in {len(windows)} requests")
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = {executor.submit(self.fetch, coin, fiat, window_start, window_end): coin
+                       for coin, (window_start, window_end, window_resolution) in windows}
+            for future in as_completed(futures):
+                try:
+                    df = future.result()
+                except (requests.RequestException, ValueError) as error:
+                    # the hole is found and downloaded again by the next gap scan
+                    print(f"Window download of {futures[future]} failed ({error}) -> skipping it")
+                    continue
+                yield futures[future], df
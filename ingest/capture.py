@@ -0,0 +1,70 @@
+import threading
+from datetime import timedelta
+
+from ingest.backfill import Backfill
+
+
+class CaptureJob:
+    """
+    Periodic job keeping stored history at the finest resolution the API currently serves
+
+    CoinGecko serves hourly data only for the last 90 days and 5 minute data only for the last day,
+    older history is daily forever. The job regularly scans the store for spans which are stored
+    coarser than they can still be downloaded and fetches them again, so the finer records replace
+    coarse ones (and their rollups) before they age out of the API.
+    """
+
+    def __init__(self, backfill: Backfill, stores: dict, launches: dict, save, fiat: str = 'usd',
+                 interval: timedelta = timedelta(hours=6)):
+        """
+        Args:
+            backfill:   downloader of missing spans
+            stores:     {coin: HistoryStore backend} which are checked for coarse spans
+            launches:   {coin: start of its history (naive UTC)}
+            save:       function(coin, df) persisting downloaded records
+            fiat:       name of currency to download price in
+            interval:   time between two runs
+        """
+
+        self.backfill: Backfill = backfill
+        self.stores: dict = stores
+        self.launches: dict = launches
+        self.save = save
+        self.fiat: str = fiat
+        self.interval: timedelta = interval
+
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def run_once(self):
+        """ Download all spans stored coarser than the API serves them (all coins in one batch) """
+
+        spans = {coin: self.backfill.find_missing(store, self.launches[coin]) for coin, store in self.stores.items()}
+        spans = {coin: coin_spans for coin, coin_spans in spans.items() if len(coin_spans) > 0}
+        if len(spans) == 0:
+            return
+
+        print(f"Capturing {sum(len(coin_spans) for coin_spans in spans.values())} spans in finer resolution")
+        for coin, df in self.backfill.fill_batch(self.fiat, spans):
+            self.save(coin, df)
+
+    def loop(self):
+        """ Run the job every interval until stopped """
+
+        while not self._stopped.wait(self.interval.total_seconds()):
+            self.run_once()
+
+    def start(self):
+        """ Start the job in background thread (the first run comes after one interval) """
+
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self.loop, name="capture-job", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """ Stop the job and wait for the running download to finish """
+
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
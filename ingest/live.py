@@ -0,0 +1,359 @@
+import threading
+import time
+from abc import ABC, abstractmethod
+from datetime import timedelta
+import numpy as np
+import polars as pl
+import requests
+
+from net.client import HttpClient
+from net.endpoints import COINGECKO_URL
+from net.scheduler import BACKGROUND, RequestScheduler
+
+
+class TickSource(ABC):
+    """
+    Source of live price ticks pushed by a provider (long-poll, websocket, ...)
+
+    poll() blocks until the provider sends new ticks or its wait time elapses, so the caller gets
+    fresh records within seconds without re-downloading whole ranges.
+    """
+
+    @abstractmethod
+    def poll(self) -> pl.DataFrame:
+        """
+        Wait for next ticks
+
+        Out:
+            df:     'coin', 'time' (naive UTC), 'price_<fiat>', 'market_cap' and 'total_volume' columns
+                    (None or empty if nothing arrived)
+        """
+
+    def close(self):
+        """ Release connections of the source """
+
+        pass
+
+
+class LongPollSource(TickSource):
+    """
+    Tick source of long-poll endpoint
+
+    GET <url>/ticks?ids=<coins>&vs_currency=<fiat>&since=<cursor>&wait=<seconds> is held by the server
+    until there are ticks newer than cursor, body is
+    {"cursor": <unix ms>, "ticks": [{"id": ..., "time": <unix ms>, "price": ..., "market_cap": ...,
+    "total_volume": ...}, ...]}. The local replay server (net/replay.py) implements the endpoint.
+    """
+
+    def __init__(self, url: str, coins: list, fiat: str = 'usd', wait: float = 25):
+        """
+        Args:
+            url:    base url of the endpoint
+            coins:  CoinGecko ids of tracked coins
+            fiat:   currency of prices
+            wait:   longest time the server holds a request in seconds
+        """
+
+        self.url: str = url.rstrip('/')
+        self.coins: list = coins
+        self.fiat: str = fiat
+        self.wait: float = wait
+        self.cursor: int = None
+
+        # held request would block a connection of the shared client
+        self.client = HttpClient(pool_size=1, read_timeout=wait + 10)
+
+    def poll(self) -> pl.DataFrame:
+        url = f"{self.url}/ticks?ids={','.join(self.coins)}&vs_currency={self.fiat}&wait={self.wait:g}"
+        if self.cursor is not None:
+            url += f"&since={self.cursor}"
+
+        data = self.client.get_json(url)
+        self.cursor = data.get('cursor', self.cursor)
+        ticks = data.get('ticks', [])
+        if len(ticks) == 0:
+            return None
+
+        df = pl.DataFrame({'coin': [tick['id'] for tick in ticks],
+                           'time': [tick['time'] for tick in ticks],
+                           f'price_{self.fiat}': [float(tick['price']) for tick in ticks],
+                           'market_cap': [tick.get('market_cap') for tick in ticks],
+                           'total_volume': [tick.get('total_volume') for tick in ticks]},
+                          schema_overrides={'market_cap': pl.Float64, 'total_volume': pl.Float64})
+
+        return df.with_columns(pl.from_epoch('time', time_unit='ms').cast(pl.Datetime('us')))
+
+    def close(self):
+        self.client.close()
+
+
+class SpotPollSource(TickSource):
+    """
+    Tick source polling CoinGecko batch spot price endpoint
+
+    One /simple/price request returns the latest price, market cap and 24h volume of all watched coins
+    in all requested currencies, so a refresh costs one request regardless of the number of coins.
+    Prices in other currencies than the first one are returned in extra 'price_<fiat>' columns.
+    """
+
+    def __init__(self, http: RequestScheduler, coins: list, fiats: list = ('usd',), interval: float = 60):
+        """
+        Args:
+            http:       request scheduler (keeps CoinGecko rate limit, shares response cache between processes)
+            coins:      CoinGecko ids of tracked coins
+            fiats:      currencies of prices, market cap and volume are taken in the first one
+            interval:   seconds between two requests
+        """
+
+        self.http: RequestScheduler = http
+        self.coins: list = coins
+        self.fiats: list = list(dict.fromkeys(fiats))
+        self.interval: float = interval
+
+        self.polled_at: float = None
+        self._closed = threading.Event()
+
+    def prepare_url(self) -> str:
+        """ Prepare url of spot prices of all coins in all currencies """
+
+        return f"{COINGECKO_URL}/simple/price?ids={','.join(self.coins)}&vs_currencies={','.join(self.fiats)}" + \
+            "&include_market_cap=true&include_24hr_vol=true&include_last_updated_at=true"
+
+    def poll(self) -> pl.DataFrame:
+        if self.polled_at is not None and self._closed.wait(self.polled_at + self.interval - time.monotonic()):
+            return None
+        self.polled_at = time.monotonic()
+
+        # {coin: {'usd': price, 'usd_market_cap': ..., 'usd_24h_vol': ..., 'czk': price, 'last_updated_at': unix}}
+        data = self.http.get_json(self.prepare_url(), BACKGROUND)
+        coins = [coin for coin in self.coins if coin in data and data[coin].get('last_updated_at') is not None]
+        if len(coins) == 0:
+            return None
+
+        fiat = self.fiats[0]
+        columns = {'coin': coins, 'time': [data[coin]['last_updated_at'] for coin in coins]}
+        for name in self.fiats:
+            columns[f'price_{name}'] = [data[coin].get(name) for coin in coins]
+        columns['market_cap'] = [data[coin].get(f'{fiat}_market_cap') for coin in coins]
+        columns['total_volume'] = [data[coin].get(f'{fiat}_24h_vol') for coin in coins]
+
+        df = pl.DataFrame(columns, schema_overrides={column: pl.Float64 for column in columns
+                                                     if column not in ('coin', 'time')})
+
+        return df.with_columns(pl.from_epoch('time', time_unit='s').cast(pl.Datetime('us')))
+
+    def close(self):
+        self._closed.set()
+
+
+class TickBuffer:
+    """
+    In-memory ring buffers of the latest ticks of every coin
+
+    Ticks stay in the buffer after they are flushed to the store, so readers which don't write
+    the store (GUI next to the refresh daemon) still see them. When a ring is full the oldest ticks
+    are overwritten, even unflushed ones (they are counted in dropped).
+    """
+
+    def __init__(self, columns: list, capacity: int = 4096):
+        """
+        Args:
+            columns:    names of value columns (besides 'time')
+            capacity:   number of kept ticks per coin
+        """
+
+        self.columns: list = columns
+        self.capacity: int = capacity
+
+        # coin: [times (us since epoch), values, written, flushed]
+        self.rings: dict = {}
+        self.version: int = 0
+        self.dropped: int = 0
+        self._lock = threading.Lock()
+
+    def push(self, coin: str, df: pl.DataFrame) -> int:
+        """
+        Add ticks of given coin, ticks not newer than the last buffered one are skipped
+
+        Args:
+            coin:   CoinGecko id
+            df:     ticks with 'time' and value columns
+
+        Out:
+            added:  number of added ticks
+        """
+
+        times = df['time'].dt.epoch('us').to_numpy()
+        values = df.select(pl.col(column).cast(pl.Float64) if column in df.columns
+                           else pl.lit(None, pl.Float64).alias(column) for column in self.columns) \
+            .to_numpy().astype(np.float64)
+
+        with self._lock:
+            if coin not in self.rings:
+                self.rings[coin] = [np.zeros(self.capacity, dtype=np.int64),
+                                    np.zeros((self.capacity, len(self.columns))), 0, 0]
+            ring = self.rings[coin]
+            ring_times, ring_values, written, flushed = ring
+
+            order = np.argsort(times, kind='stable')
+            times, values = times[order], values[order]
+            if written > 0:
+                newer = times > ring_times[(written - 1) % self.capacity]
+                times, values = times[newer], values[newer]
+            times, values = times[-self.capacity:], values[-self.capacity:]
+            if len(times) == 0:
+                return 0
+
+            positions = np.arange(written, written + len(times)) % self.capacity
+            ring_times[positions] = times
+            ring_values[positions] = values
+            written += len(times)
+            if written - flushed > self.capacity:
+                self.dropped += written - flushed - self.capacity
+                flushed = written - self.capacity
+            ring[2], ring[3] = written, flushed
+            self.version += 1
+
+        return len(times)
+
+    def frame(self, coin: str, first: int, last: int) -> pl.DataFrame:
+        """ Get ticks number first to last (exclusive) of given coin as DataFrame (call with lock held) """
+
+        ring_times, ring_values = self.rings[coin][:2]
+        positions = np.arange(first, last) % self.capacity
+        df = pl.DataFrame({column: ring_values[positions, i] for i, column in enumerate(self.columns)})
+
+        return df.with_columns(pl.from_epoch(pl.Series('time', ring_times[positions]), time_unit='us'),
+                               pl.all().exclude('time').fill_nan(None)).select('time', *self.columns)
+
+    def drain(self, coin: str) -> pl.DataFrame:
+        """ Get unflushed ticks of given coin and mark them flushed """
+
+        with self._lock:
+            if coin not in self.rings:
+                return None
+            written, flushed = self.rings[coin][2:]
+            self.rings[coin][3] = written
+
+            return self.frame(coin, flushed, written) if written > flushed else None
+
+    def recent(self, coin: str, since=None) -> pl.DataFrame:
+        """ Get buffered ticks of given coin newer than since (None = all buffered ticks) """
+
+        with self._lock:
+            if coin not in self.rings:
+                return None
+            written = self.rings[coin][2]
+            df = self.frame(coin, max(written - self.capacity, 0), written)
+
+        return df if since is None else df.filter(pl.col('time') > since)
+
+    def coins(self) -> list:
+        """ Get coins with buffered ticks """
+
+        with self._lock:
+            return list(self.rings.keys())
+
+
+class LiveFeed:
+    """
+    Ingestion of live ticks
+
+    Background thread polls the tick source and pushes ticks into ring buffers, which are flushed
+    to the store in batches (every flush interval or once enough ticks are waiting), so frequent
+    ticks don't create a store segment each.
+    """
+
+    def __init__(self, source: TickSource, save, columns: list, capacity: int = 4096,
+                 flush_interval: timedelta = timedelta(seconds=30), flush_size: int = 256):
+        """
+        Args:
+            source:         source of ticks
+            save:           function(coin, df) persisting flushed ticks (None = ticks are only buffered)
+            columns:        names of value columns (besides 'time')
+            capacity:       number of buffered ticks per coin
+            flush_interval: longest time between two flushes
+            flush_size:     number of waiting ticks which triggers flush
+        """
+
+        self.source: TickSource = source
+        self.save = save
+        self.buffer: TickBuffer = TickBuffer(columns, capacity)
+        self.flush_interval: timedelta = flush_interval
+        self.flush_size: int = flush_size
+
+        self.waiting: int = 0
+        self.flushed_at: float = time.monotonic()
+        self.reported_dropped: int = 0
+
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def ingest(self, df: pl.DataFrame):
+        """ Push ticks into ring buffers and flush them if a flush is due """
+
+        if df is not None and df.height > 0:
+            for (coin,), coin_df in df.group_by('coin'):
+                self.waiting += self.buffer.push(coin, coin_df)
+
+        if self.waiting >= self.flush_size or \
+                time.monotonic() - self.flushed_at >= self.flush_interval.total_seconds():
+            self.flush()
+
+    def flush(self):
+        """ Save all unflushed ticks and report ticks dropped by full buffers since the last flush """
+
+        self.flushed_at = time.monotonic()
+        self.waiting = 0
+        dropped = self.buffer.dropped
+        if dropped > self.reported_dropped:
+            print(f"Live tick buffer is full -> {dropped - self.reported_dropped} unsaved ticks were dropped")
+            self.reported_dropped = dropped
+        if self.save is None:
+            return
+
+        for coin in self.buffer.coins():
+            df = self.buffer.drain(coin)
+            if df is not None:
+                self.save(coin, df)
+
+    def loop(self):
+        """ Poll the source until stopped, failed polls are retried with growing delay """
+
+        failures = 0
+        while not self._stopped.is_set():
+            try:
+                df = self.source.poll()
+                failures = 0
+            except (requests.RequestException, ValueError, KeyError) as e:
+                if self._stopped.is_set():
+                    break
+                failures += 1
+                delay = min(2 ** failures, 60)
+                print(f"Live feed poll failed ({e}) -> retrying in {delay} s")
+                self._stopped.wait(delay)
+                df = None
+
+            self.ingest(df)
+
+    def start(self):
+        """ Start polling in background thread """
+
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self.loop, name="live-feed", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 5):
+        """
+        Stop polling and flush buffered ticks
+
+        Args:
+            timeout:    seconds to wait for the running poll (a held long-poll is abandoned after that)
+        """
+
+        self._stopped.set()
+        self.source.close()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+        self.flush()
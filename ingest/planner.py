@@ -0,0 +1,110 @@
+"""
+Fetch planner for CoinGecko market_chart/range
+
+The endpoint picks resolution of returned data by the requested span: 5 minute data for spans
+of up to one day inside the last day, hourly data for spans of up to 90 days inside the last 90 days
+and daily data for anything else. Planner turns a time range and desired resolution into the
+smallest set of request windows which gets that resolution (or the finest one the API still serves)
+for every part of the range.
+"""
+
+from datetime import datetime, timedelta, timezone
+
+# name: (time step, age of the oldest data served in it (None = any), maximal span of one request (None = any))
+# ordered from the finest to the coarsest resolution
+RESOLUTIONS = {
+    '5m': (timedelta(minutes=5), timedelta(days=1), timedelta(days=1)),
+    '1h': (timedelta(hours=1), timedelta(days=90), timedelta(days=90)),
+    '1d': (timedelta(days=1), None, None),
+}
+
+
+def coarser(first: str, second: str) -> str:
+    """ Get the coarser of two resolutions (None = the finest available) """
+
+    names = list(RESOLUTIONS.keys())
+    if first is None or second is None:
+        return second if first is None else first
+
+    return names[max(names.index(first), names.index(second))]
+
+
+def horizon(resolution: str, now: datetime) -> datetime:
+    """
+    Get the oldest time served in given resolution, aligned up to whole step of the next coarser resolution
+    so that planned windows (and their cached responses) don't change every minute
+
+    Out:
+        horizon:    aligned time (None = resolution is served for any time)
+    """
+
+    names = list(RESOLUTIONS.keys())
+    step, age, max_span = RESOLUTIONS[resolution]
+    if age is None:
+        return None
+
+    align = RESOLUTIONS[names[names.index(resolution) + 1]][0]
+    oldest = now - age
+
+    return datetime.min + (oldest - datetime.min) // align * align + align
+
+
+def available_resolution(time: datetime, now: datetime) -> str:
+    """ Get the finest resolution the API serves for records at given time """
+
+    for name in RESOLUTIONS.keys():
+        oldest = horizon(name, now)
+        if oldest is None or time >= oldest:
+            return name
+
+
+def window_resolution(start: datetime, end: datetime, now: datetime) -> str:
+    """ Get resolution of data returned for request window between start and end """
+
+    for name, (step, age, max_span) in RESOLUTIONS.items():
+        if age is None or (start >= now - age and end - start <= max_span):
+            return name
+
+
+def plan_fetches(start: datetime, end: datetime, resolution: str = None, now: datetime = None) -> list:
+    """
+    Split range into the cheapest set of request windows reaching desired resolution
+
+    Args:
+        start:          range start (naive UTC)
+        end:            range end (naive UTC)
+        resolution:     desired resolution ('5m', '1h', '1d' or None = the finest available)
+        now:            current time (None = now)
+
+    Out:
+        windows:        list of (start, end, resolution) tuples sorted by time
+    """
+
+    if now is None:
+        now = datetime.now(timezone.utc).replace(tzinfo=None)
+
+    windows = []
+    window_start = start
+    while window_start < end:
+        target = coarser(resolution, available_resolution(window_start, now))
+
+        # the rest fits into one request which is fine enough everywhere
+        finest = coarser(resolution, available_resolution(end, now))
+        returned = window_resolution(window_start, end, now)
+        if coarser(returned, finest) == finest:
+            windows.append((window_start, end, returned))
+            break
+
+        # don't cross the time where finer resolution becomes available
+        band_end = end
+        for name in RESOLUTIONS.keys():
+            oldest = horizon(name, now)
+            if oldest is not None and window_start < oldest < band_end and coarser(resolution, name) != target:
+                band_end = oldest
+
+        max_span = RESOLUTIONS[target][2]
+        window_end = band_end if max_span is None else min(window_start + max_span, band_end)
+        windows.append((window_start, window_end, target))
+        window_start = window_end
+
+    return windows
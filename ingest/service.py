@@ -0,0 +1,441 @@
+import calendar
+import json
+import os
+import platform
+import threading
+from datetime import datetime, timedelta, timezone
+from functools import partial
+from os.path import expanduser
+import numpy as np
+import polars as pl
+import requests
+
+from ingest.backfill import Backfill
+from ingest.capture import CaptureJob
+from ingest.live import LiveFeed, LongPollSource, SpotPollSource, TickSource
+from ingest.watchlist import load_watchlist
+from net.endpoints import COINGECKO_URL, EXCHANGE_URL, LIVE_URL
+from net.market_chart import decode_market_chart
+from net.scheduler import BACKGROUND, INTERACTIVE, get_scheduler
+from store.fx import FxStore
+from store.journal import Journal
+from store.lock import ProcessLock
+from store.sqlite_store import SqliteStore
+from store.tiers import TieredStore
+from store.timeindex import local_to_utc
+
+
+def get_app_path() -> str:
+    """ Get platform specific directory of application data (None on unknown platform) """
+
+    system = platform.system()
+    if system == "Linux":
+        return os.path.join(expanduser("~"), ".local", "share", "SolWatcher")
+    if system == "Windows":
+        return os.path.join(expanduser("~"), "AppData", "Local", "SolWatcher")
+
+    return None
+
+
+class IngestService:
+    """
+    Download and storage of price history of all watched coins without any GUI dependency
+
+    Used by the GUI and by the headless refresh daemon. History is partitioned by coin, every coin
+    has its own tiered store and journal. Only the process holding the store lock downloads and writes,
+    every other process just reads the shared store.
+    """
+
+    def __init__(self, app_path: str, backend: str = 'segments', fiat: str = 'usd'):
+        """
+        Args:
+            app_path:   directory of application data
+            backend:    storage backend of price history ('segments' or 'sqlite')
+            fiat:       currency to download price in
+        """
+
+        self.fiat: str = fiat
+
+        self.app_path: str = app_path
+        self.df_path = os.path.join(self.app_path, "dataframe.json")
+        self.store_path = os.path.join(self.app_path, "store")
+        self.db_path = os.path.join(self.app_path, "history.sqlite")
+        self.cache_path = os.path.join(self.app_path, "cache")
+        self.lock_path = os.path.join(self.app_path, "writer.lock")
+        self.watchlist_path = os.path.join(self.app_path, "watchlist.json")
+        self.fx_path = os.path.join(self.app_path, "fx")
+        self.utc_path = os.path.join(self.app_path, "store_utc")
+
+        if not os.path.exists(self.app_path):
+            os.makedirs(self.app_path)
+
+        # {CoinGecko id: launch datetime}
+        self.watchlist: dict = load_watchlist(self.watchlist_path)
+        self.migrate_layout()
+
+        self.stores: dict = {}
+        self.journals: dict = {}
+        for coin in self.watchlist.keys():
+            if backend == 'sqlite':
+                self.stores[coin] = SqliteStore(self.db_path, coin)
+            else:
+                self.stores[coin] = TieredStore(os.path.join(self.store_path, coin))
+            self.journals[coin] = Journal(self.journal_path(coin), [f'price_{fiat}', 'market_cap', 'total_volume'])
+
+        # daily exchange rates of USD to display currencies
+        self.fx = FxStore(self.fx_path)
+
+        self.lock = ProcessLock(self.lock_path)
+        self.store_lock = threading.Lock()
+        self.capture_job = None
+        self.live_feed = None
+
+        self.http = get_scheduler(self.cache_path)
+
+    def journal_path(self, coin: str) -> str:
+        """ Get path of write-ahead journal of given coin """
+
+        return os.path.join(self.app_path, f"journal_{coin}.wal")
+
+    def migrate_layout(self):
+        """ Move single-coin (solana) store and journal of older versions into per-coin layout """
+
+        if os.path.isdir(os.path.join(self.store_path, 'raw')):
+            print("Moving solana history into per-coin store...")
+            coin_path = os.path.join(self.store_path, 'solana')
+            os.makedirs(coin_path, exist_ok=True)
+            for name in os.listdir(self.store_path):
+                if name != 'solana':
+                    os.replace(os.path.join(self.store_path, name), os.path.join(coin_path, name))
+
+        old_journal_path = os.path.join(self.app_path, "journal.wal")
+        if os.path.exists(old_journal_path):
+            os.replace(old_journal_path, self.journal_path('solana'))
+
+    @staticmethod
+    def get_current_time() -> datetime:
+        """ Get current UTC time (all stored times are naive UTC) """
+
+        return datetime.now(timezone.utc).replace(tzinfo=None)
+
+    @staticmethod
+    def prepare_api_url(coin: str, fiat: str, start: str, end: str) -> str:
+        """
+        Prepare url for CoinGecko API request
+
+        Args:
+            coin:   name of cryptocurrency
+            fiat:   name of currency to display price in
+            start:  unix-like start timestamp
+            end:    unix-like end timestamp
+
+        Out:
+            url:    request url
+        """
+
+        url = f"{COINGECKO_URL}/coins/" + \
+              f"{coin}/market_chart/range?vs_currency={fiat}&from={start}&to={end}"
+
+        return url
+
+    def download_hist_data(self, coin: str = 'solana', fiat: str = 'usd', time_s: datetime = None,
+                           time_e: datetime = None, priority: int = INTERACTIVE) -> pl.DataFrame:
+        """
+        Download historical data of selected coin from given interval
+
+        Args:
+            coin:       name of cryptocurrency
+            fiat:       name of currency to display price in
+            time_s:     interval start datetime (naive UTC)
+            time_e:     interval end datetime (naive UTC)
+            priority:   request priority class (INTERACTIVE or BACKGROUND)
+
+        Out:
+            df:         'price_<fiat>', 'time' (timestamps reported by the API), 'market_cap' and 'total_volume'
+                        (24h volume) columns
+        """
+
+        print(f"Downloading data between {time_s} and {time_e}")
+
+        # unix timestamp (eg 1392577232)
+        start = calendar.timegm(time_s.timetuple())
+        end = calendar.timegm(time_e.timetuple())
+
+        url = self.prepare_api_url(coin, fiat, str(start), str(end))
+
+        # {'prices': [[unix ms timestamp, price], ...], 'market_caps': [...], 'total_volumes': [...]}
+        series = decode_market_chart(self.http.stream_body(url, priority))
+        timestamps, prices = series['prices']
+        df = pl.DataFrame({f'price_{fiat}': prices, 'time': timestamps})
+
+        # the other series normally share timestamps of prices
+        for name, column in (('market_caps', 'market_cap'), ('total_volumes', 'total_volume')):
+            series_times, values = series.get(name, (np.empty(0, dtype=np.int64), np.empty(0)))
+            if np.array_equal(series_times, timestamps):
+                df = df.with_columns(pl.Series(column, values))
+            else:
+                other = pl.DataFrame({'time': series_times, column: values}).unique('time', keep='last')
+                df = df.join(other, on='time', how='left')
+
+        return df.with_columns(pl.from_epoch('time', time_unit='ms').cast(pl.Datetime('us')),
+                               pl.col('market_cap', 'total_volume').fill_nan(None))
+
+    def download_fx(self, currencies: list, time_s: datetime, time_e: datetime) -> dict:
+        """
+        Download daily exchange rates of USD to given currencies (one request per 365 days)
+
+        Args:
+            currencies: currency codes
+            time_s:     first day (naive UTC)
+            time_e:     last day (naive UTC)
+
+        Out:
+            rates:      {currency: DataFrame with 'time' (start of the day) and 'rate' columns}
+        """
+
+        symbols = ','.join(currency.upper() for currency in currencies)
+        frames = []
+        day = time_s.replace(hour=0, minute=0, second=0, microsecond=0)
+        while day <= time_e:
+            last_day = min(day + timedelta(days=364), time_e)
+            print(f"Downloading {symbols} exchange rates between {day.date()} and {last_day.date()}")
+
+            # {'rates': {'YYYY-MM-DD': {currency: rate, ...}, ...}, ...}
+            data = self.http.get_json(f"{EXCHANGE_URL}/timeseries?base=USD&symbols={symbols}"
+                                      f"&start_date={day:%Y-%m-%d}&end_date={last_day:%Y-%m-%d}")
+            rows = [{'time': date, **day_rates} for date, day_rates in data.get('rates', {}).items()]
+            if len(rows) > 0:
+                frames.append(pl.DataFrame(rows, infer_schema_length=None))
+            day += timedelta(days=365)
+
+        rates = {}
+        if len(frames) == 0:
+            return rates
+
+        df = pl.concat(frames, how="diagonal_relaxed") \
+            .with_columns(pl.col('time').str.to_datetime("%Y-%m-%d", time_unit='us'))
+        for currency in currencies:
+            if currency.upper() in df.columns:
+                rates[currency] = df.select('time', pl.col(currency.upper()).cast(pl.Float64).alias('rate')) \
+                    .drop_nulls().unique('time', keep='last').sort('time')
+
+        return rates
+
+    def update_fx(self, currencies: list):
+        """
+        Download daily exchange rates of given currencies missing since the launch of the oldest watched coin,
+        rate of the latest stored day is downloaded again (it changes until the day ends)
+
+        Args:
+            currencies: currency codes (USD is skipped)
+        """
+
+        currencies = list(dict.fromkeys(currency.upper() for currency in currencies if currency.upper() != 'USD'))
+        if len(currencies) == 0:
+            return
+
+        start = min(self.watchlist.values())
+        latest = [self.fx.latest(currency) for currency in currencies]
+        time_s = min(start if day is None else max(day, start) for day in latest)
+        try:
+            rates = self.download_fx(currencies, time_s, self.get_current_time())
+        except (requests.RequestException, ValueError) as e:
+            print(f"Downloading exchange rates failed ({e}) -> using stored rates")
+            return
+
+        for currency, df in rates.items():
+            self.fx.append(currency, df)
+
+    def acquire(self) -> bool:
+        """ Try to become the writer of the store (False = another process writes it) """
+
+        return self.lock.acquire()
+
+    def release(self):
+        """ Stop background work and let another process write the store """
+
+        self.stop_live()
+        self.stop_capture()
+        self.lock.release()
+
+    def load(self):
+        """ Prepare stored history for reading, the writer also migrates old data and recovers the journals """
+
+        if self.lock.held:
+            self.migrate_local_time()
+            if 'solana' in self.stores and not self.stores['solana'].exists() and os.path.exists(self.df_path):
+                self.migrate_dataframe()
+
+        for store in self.stores.values():
+            store.load()
+
+        if self.lock.held:
+            self.recover_journals()
+
+    def update(self, min_diff: int = 5):
+        """
+        Download all-time history of newly watched coins and missing data of the others in one batch -
+        the latest records and holes left by failed or coarse downloads (while the live feed runs,
+        the latest records come from it and nothing is missing at the end)
+
+        Args:
+            min_diff:   minimal length of downloaded gap in minutes
+        """
+
+        current_time = self.get_current_time()
+        spans = {}
+        for coin, launch in self.watchlist.items():
+            if not self.stores[coin].exists():
+                print(f"Creating new history of {coin} (downloading all-time data) ...")
+                spans[coin] = [(launch, current_time)]
+                continue
+
+            missing = Backfill.find_missing(self.stores[coin], launch, current_time)
+            spans[coin] = [(start, end) for start, end in missing if end - start > timedelta(minutes=min_diff)]
+            for start_time, end_time in spans[coin]:
+                print(f"Fetching {coin} data from {start_time} to {end_time}")
+
+        spans = {coin: coin_spans for coin, coin_spans in spans.items() if len(coin_spans) > 0}
+        if len(spans) == 0:
+            print(f"Data of {len(self.watchlist)} coins are up-to-date")
+            return
+
+        # downloads are streamed into the stores as they arrive
+        for coin, new_df in Backfill(self.download_hist_data).fill_batch(self.fiat, spans):
+            self.save_downloaded(coin, new_df)
+
+    def start_capture(self):
+        """ Start background job which upgrades stored history to the finest resolution the API serves """
+
+        backfill = Backfill(partial(self.download_hist_data, priority=BACKGROUND))
+        self.capture_job = CaptureJob(backfill, self.stores, self.watchlist, self.save_downloaded, self.fiat)
+        self.capture_job.start()
+
+    def stop_capture(self):
+        """ Stop capture job if it runs """
+
+        if self.capture_job is not None:
+            self.capture_job.stop()
+            self.capture_job = None
+
+    def start_live(self, source: TickSource = None, fiats: list = ()) -> LiveFeed:
+        """
+        Start ingestion of live ticks of all watched coins, only the writer saves them to the stores
+
+        Args:
+            source:     source of ticks (None = long-poll endpoint at SOLWATCHER_LIVE_URL if it is set,
+                        otherwise batch spot price polling of CoinGecko)
+            fiats:      other currencies whose spot prices are buffered in 'price_<fiat>' columns
+
+        Out:
+            feed:       started live feed
+        """
+
+        if source is None and LIVE_URL is not None:
+            source = LongPollSource(LIVE_URL, list(self.watchlist.keys()), self.fiat)
+        elif source is None:
+            source = SpotPollSource(self.http, list(self.watchlist.keys()), [self.fiat, *fiats])
+
+        columns = [f'price_{fiat}' for fiat in dict.fromkeys([self.fiat, *fiats])] + ['market_cap', 'total_volume']
+        save = self.save_live if self.lock.held else None
+        self.live_feed = LiveFeed(source, save, columns)
+        self.live_feed.start()
+
+        return self.live_feed
+
+    def stop_live(self):
+        """ Stop live feed if it runs (buffered ticks are saved) """
+
+        if self.live_feed is not None:
+            self.live_feed.stop()
+            self.live_feed = None
+
+    def recover_journals(self):
+        """ Replay records left in journals by interrupted save and persist them """
+
+        for coin, journal in self.journals.items():
+            journal_df = journal.replay()
+            if journal_df is None:
+                continue
+
+            print(f"Recovering {journal_df.height} records of {coin} from journal...")
+            self.stores[coin].ingest(journal_df)
+            journal.clear()
+
+    def save_downloaded(self, coin: str, new_df: pl.DataFrame):
+        """ Journal and save downloaded records of given coin (safe to call from background threads) """
+
+        with self.store_lock:
+            self.journals[coin].append(new_df)
+            self.stores[coin].ingest(new_df)
+            # segments are fsync'd when ingest returns, only then the journaled records may be dropped
+            self.journals[coin].clear()
+
+    def save_live(self, coin: str, new_df: pl.DataFrame):
+        """ Save batch of live ticks of given coin (ticks of coins which are not watched are dropped) """
+
+        if coin in self.stores:
+            self.save_downloaded(coin, new_df)
+
+    def migrate_local_time(self):
+        """
+        Shift records which older versions stored in local time to UTC (once, the store_utc file marks
+        stores which hold UTC)
+        """
+
+        if os.path.exists(self.utc_path):
+            return
+
+        for coin, store in self.stores.items():
+            if store.exists():
+                print(f"Converting history of {coin} from local time to UTC...")
+                store.convert_local_time()
+
+        with open(self.utc_path, 'w') as utc_file:
+            utc_file.write("times are naive UTC\n")
+
+    @staticmethod
+    def read_dataframe_json(path: str) -> pl.DataFrame:
+        """
+        Read dataframe.json written by older versions
+
+        Polars of that time wrote either columnar layout {"columns": [{"name": ..., "datatype": ..., "values": [...]}]}
+        with integer times or list of rows with time strings.
+
+        Args:
+            path:   file path
+
+        Out:
+            df:     'price_usd' and 'time' (naive datetime) columns
+        """
+
+        with open(path, 'r') as df_file:
+            data = json.load(df_file)
+
+        unit = 'us'
+        if isinstance(data, dict) and 'columns' in data:
+            columns = {column['name']: column['values'] for column in data['columns']}
+            datatype = str(next(column.get('datatype') for column in data['columns'] if column['name'] == 'time'))
+            unit = 'ns' if 'Nano' in datatype else 'ms' if 'Milli' in datatype else 'us'
+        elif isinstance(data, dict):
+            columns = data
+        else:
+            columns = {name: [row[name] for row in data] for name in ('price_usd', 'time')}
+
+        df = pl.DataFrame({'price_usd': pl.Series(columns['price_usd'], dtype=pl.Float64),
+                           'time': pl.Series(columns['time'])})
+        if df['time'].dtype == pl.String:
+            time = pl.col('time').str.to_datetime(time_unit='us', strict=False)
+        else:
+            time = pl.from_epoch(pl.col('time').cast(pl.Int64), time_unit=unit)
+
+        return df.with_columns(time.cast(pl.Datetime('us'))).drop_nulls().sort('time')
+
+    def migrate_dataframe(self):
+        """ Move data from old dataframe.json file (solana only) into local store """
+
+        print("Migrating dataframe.json to local store...")
+        df = self.read_dataframe_json(self.df_path)
+        # older versions kept local time
+        self.stores['solana'].ingest(df.with_columns(local_to_utc(df['time'])).sort('time'))
+        os.replace(self.df_path, self.df_path + ".bak")
@@ -0,0 +1,29 @@
+import json
+import os
+from datetime import datetime
+
+# CoinGecko ids with the first day of their price history
+DEFAULT_WATCHLIST = [{'id': 'solana', 'launch': '2020-04-11'}]
+
+
+def load_watchlist(path: str) -> dict:
+    """
+    Load watchlist of tracked coins, default watchlist is written if the file does not exist
+
+    File holds JSON list like [{"id": "solana", "launch": "2020-04-11"}, {"id": "bitcoin", "launch": "2013-04-28"}]
+
+    Args:
+        path:       watchlist file path
+
+    Out:
+        watchlist:  {CoinGecko id: launch datetime} in order of the file
+    """
+
+    if not os.path.exists(path):
+        with open(path, 'w') as watchlist_file:
+            json.dump(DEFAULT_WATCHLIST, watchlist_file, indent=2)
+
+    with open(path, 'r') as watchlist_file:
+        entries = json.load(watchlist_file)
+
+    return {entry['id']: datetime.strptime(entry['launch'], "%Y-%m-%d") for entry in entries}
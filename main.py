@@ -1,61 +1,60 @@
+import calendar
 import json
 import os
 import platform
 import polars as pl
 import numpy as np
 import pyqtgraph as pg
-from urllib.request import urlopen
-from datetime import datetime, timedelta
+import requests
+from datetime import datetime, timedelta, timezone
 
+from PyQt6.QtCore import QTimer
 from PyQt6.QtGui import QPalette
 from PyQt6.QtWidgets import *
 from PyQt6 import QtWidgets, QtGui
-import time
 from os.path import expanduser
-import requests
 import sys
 
 from gui import form
+from ingest.service import IngestService, get_app_path
+from net.endpoints import EXCHANGE_URL
+from store.fx import to_fiat
+from store.stats import collect_windows, window_stats
 
 pg.setConfigOptions(background='w', foreground='k', antialias=True)
 
 
 class SolWatcher(form.Ui_MainWindow):
 
-    def __init__(self):
+    def __init__(self, backend: str = 'segments', coin: str = 'solana'):
         """
         Prepare system paths and variables
+
+        Args:
+            backend:    storage backend of price history ('segments' or 'sqlite')
+            coin:       CoinGecko id of displayed cryptocurrency (the first watched coin if it is not watched)
         """
 
         self.MainWindow = None
 
         """ Paths """
 
-        self.sol_launch = datetime(2020, 4, 11)
-
         self.user_path: str = expanduser("~")
-        self.app_path: str = self.user_path
         self.platform = platform.system()
-        if self.platform == "Linux":
-            self.app_path = self.user_path + "/.local/share/SolWatcher"
-            self.df_path = self.app_path + "/dataframe.json"
-            self.ex_path = self.app_path + "/exchanges.json"
-        elif self.platform == "Windows":
-            self.app_path = self.user_path + "\AppData\Local\SolWatcher"
-            self.df_path = self.app_path + "\dataframe.json"
-            self.ex_path = self.app_path + "\exchanges.json"
-        else:
+        self.app_path: str = get_app_path()
+        if self.app_path is None:
             print("Unknown platform!")
             exit(100)
-
-        if not os.path.exists(self.app_path):
-            os.makedirs(self.app_path)
+        self.ex_path = os.path.join(self.app_path, "exchanges.json")
 
         """ Dataframe """
 
-        self.df = None
-        self.oldest_record = None
-        self.latest_record = None
+        # downloading and storing is shared with the headless refresh daemon
+        self.service = IngestService(self.app_path, backend)
+        self.coin: str = coin if coin in self.service.watchlist else next(iter(self.service.watchlist))
+        self.sol_launch = self.service.watchlist[self.coin]
+        self.store = self.service.stores[self.coin]
+        self.http = self.service.http
 
         self.exchange_rates = None
         self.exchange_rates_last_update: datetime = datetime(1970, 1, 1)
@@ -73,6 +72,10 @@ class SolWatcher(form.Ui_MainWindow):
 
         self.current_usd_price: float = 0
 
+        # live feed
+        self.live_timer = None
+        self.live_version: int = 0
+
     def init(self, main_window):
         """ Initialize PyQt6 Window """
         self.MainWindow = main_window
@@ -80,55 +83,78 @@ class SolWatcher(form.Ui_MainWindow):
         self.MainWindow.setWindowIcon(QtGui.QIcon('data/logo_300.png'))
 
     def init_df(self):
-        """ Load existing data or create new DataFrame """
+        """ Load local data and download missing data (unless the refresh daemon keeps them up-to-date) """
 
-        if os.path.exists(self.df_path):
-            print("Loading existing data...")
-            self.load_dataframe()
+        if self.service.acquire():
+            if self.store.exists() or os.path.exists(self.service.df_path):
+                print("Loading existing data...")
+            else:
+                print("No local data -> downloading whole history")
+            self.service.load()
+            self.service.update()
         else:
-            print("Creating new DataFrame (downloading all-time data) ...")
-
-            # all-time data (low precision)
-            time_end = self.get_current_time() - timedelta(days=30)
-            time_start = self.sol_launch
-            prices_list, timestamps_list = self.download_hist_data(coin='solana', fiat='usd', time_s=time_start,
-                                                                   time_e=time_end)
-
-            # 30 days data (higher precision)
-            time_end = self.get_current_time() - timedelta(days=1)
-            time_start = time_end - timedelta(days=30)
-            prices_30_list, timestamps_30_list = self.download_hist_data(coin='solana', fiat='usd', time_s=time_start,
-                                                                         time_e=time_end)
-            prices_list, timestamps_list = self.add_new_records(prices_list, timestamps_list,
-                                                                prices_30_list, timestamps_30_list)
-
-            # 1 day data (even higher precision)
-            time_end = self.get_current_time()
-            time_start = time_end - timedelta(days=1)
-            prices_24_list, timestamps_24_list = self.download_hist_data(coin='solana', fiat='usd', time_s=time_start,
-                                                                         time_e=time_end)
-            prices_list, timestamps_list = self.add_new_records(prices_list, timestamps_list,
-                                                                prices_24_list, timestamps_24_list)
-
-            # create dataframe
-            self.df = pl.DataFrame({'price_usd': prices_list,
-                                    'time': timestamps_list})
-
-            # sort DataFrame
-            self.df = self.df.sort('time')
-
-            self.save_dataframe()
+            print("Refresh daemon is running -> using local data")
+            self.service.load()
+
+    def init_capture(self):
+        """ Start background job which upgrades stored history to the finest resolution the API serves """
+
+        if self.service.lock.held:
+            self.service.start_capture()
+
+    def init_live(self):
+        """ Start live feed of spot prices and redraw 24 hours tab when ticks arrive """
+
+        self.service.start_live(fiats=[self.display_fiat])
+        self.live_timer = QTimer(self.MainWindow)
+        self.live_timer.timeout.connect(self.refresh_live)
+        self.live_timer.start(2000)
+
+    def refresh_live(self):
+        """ Redraw 24 hours tab with stored records and buffered live ticks (if new ticks arrived) """
+
+        feed = self.service.live_feed
+        if feed is None or feed.buffer.version == self.live_version:
+            return
+        self.live_version = feed.buffer.version
+
+        # ticks are flushed to the store in batches (or by the refresh daemon), the rest is in the buffer
+        delta = timedelta(days=1)
+        current_time = self.get_current_time()
+        df, stats = self.collect_move_windows([delta], current_time)[0]
+        since = current_time - delta if stats is None or stats['last_time'] is None else stats['last_time']
+        ticks = feed.buffer.recent(self.coin, since)
+        if ticks is None or ticks.height == 0:
+            return
+
+        # spot prices in display currency give the current exchange rate too
+        fiat_column = f'price_{self.display_fiat}'
+        rated = ticks.drop_nulls(['price_usd', fiat_column]) if fiat_column in ticks.columns else None
+        if rated is not None and rated.height > 0 and self.exchange_rates is not None:
+            self.exchange_rates[self.display_fiat.upper()] = rated[fiat_column][-1] / rated['price_usd'][-1]
+            self.exchange_rates_last_update = rated['time'][-1]
+
+        df = ticks if df is None else pl.concat([df, ticks], how="diagonal_relaxed")
+        stats = window_stats(df.lazy()).collect().row(0, named=True)
+        self.print_move_stats(delta, fiat='czk', plot=self.graphicsView_24h, window=(df, stats))
+        self.time_tab_changed()
 
     def init_exchanges(self):
-        """ Load existing exchange data or load from internet """
+        """ Load existing exchange data or load from internet, update history of exchange rates of display currency """
+
+        if self.service.lock.held:
+            self.service.update_fx([self.display_fiat])
+        else:
+            # the refresh daemon downloads rates of requested currencies
+            self.service.fx.request(self.display_fiat)
 
         if os.path.exists(self.ex_path):
             print("Loading existing exchange rates...")
             self.load_exchange_data()
         else:
             print("Local exchange rates data not found...")
-            self.get_exchange_data()
-            self.save_exchange_data()
+            if self.get_exchange_data():
+                self.save_exchange_data()
 
     def init_gui(self):
         """ Initialize gui slots and plot default data """
@@ -136,17 +162,23 @@ class SolWatcher(form.Ui_MainWindow):
         self.connect_slots()
 
         print("\nDescription:")
-        print(self.df.describe())
-        print("")
-        self.print_move_stats(timedelta(days=1), fiat='czk', plot=self.graphicsView_24h)
-        print("")
-        self.print_move_stats(timedelta(days=7), fiat='czk', plot=self.graphicsView_7d)
-        print("")
-        self.print_move_stats(timedelta(days=30), fiat='czk', plot=self.graphicsView_30d)
-        print("")
-        self.print_move_stats(timedelta(days=365), fiat='czk', plot=self.graphicsView_1y)
-        print("")
-        self.print_move_stats(self.get_current_time() - self.sol_launch, fiat='czk', plot=self.graphicsView_at)
+        raw = self.store.scan('raw')
+        if raw is None:
+            print("No data are stored yet (downloads failed) -> missing data are downloaded on the next refresh")
+        else:
+            print(raw.describe())
+
+        # all windows are collected as one query plan
+        current_time = self.get_current_time()
+        windows = [(timedelta(days=1), self.graphicsView_24h),
+                   (timedelta(days=7), self.graphicsView_7d),
+                   (timedelta(days=30), self.graphicsView_30d),
+                   (timedelta(days=365), self.graphicsView_1y),
+                   (current_time - self.sol_launch, self.graphicsView_at)]
+        results = self.collect_move_windows([delta for delta, plot in windows], current_time)
+        for (delta, plot), window in zip(windows, results):
+            print("")
+            self.print_move_stats(delta, fiat='czk', plot=plot, window=window)
 
         # default page (24 Hours)
         self.tabWidget.setCurrentIndex(0)
@@ -156,81 +188,11 @@ class SolWatcher(form.Ui_MainWindow):
 
         self.tabWidget.currentChanged.connect(self.time_tab_changed)
 
-    @staticmethod
-    def add_new_records(prices: list, timestamps: list, prices_new: list, timestamps_new: list) -> (list, list):
-        """ Add just new price records to existing lists """
-
-        for i in range(len(timestamps_new)):
-            if timestamps_new[i] not in timestamps:
-                prices.append(prices_new[i])
-                timestamps.append(timestamps_new[i])
-
-        return prices, timestamps
-
     @staticmethod
     def get_current_time() -> datetime:
-        """ Get current time """
-
-        return datetime.now()
-
-    @staticmethod
-    def prepare_api_url(coin: str, fiat: str, start: str, end: str) -> str:
-        """
-        Prepare url for CoinGecko API request
+        """ Get current UTC time (all stored times are naive UTC) """
 
-        Args:
-            coin:   name of cryptocurrency
-            fiat:   name of currency to display price in
-            start:  unix-like start timestamp
-            end:    unix-like end timestamp
-
-        Out:
-            url:    request url
-        """
-
-        url = "https://api.coingecko.com/api/v3/coins/" + \
-              f"{coin}/market_chart/range?vs_currency={fiat}&from={start}&to={end}"
-
-        return url
-
-    def download_hist_data(self, coin: str = 'solana', fiat: str = 'usd',
-                           time_s: datetime = None, time_e: datetime = None) -> (list, list):
-        """
-        Download historical data of selected coin from given interval
-
-        Args:
-            coin:       name of cryptocurrency
-            fiat:       name of currency to display price in
-            time_s:     interval start datetime
-            time_e:     interval end datetime
-
-        Out:
-            prices:         list of prices
-            timestamps:     list of datetime times
-        """
-
-        delta = time_e - time_s
-
-        print(f"Downloading data between {time_s} and {time_e}")
-
-        time_s = time_s.replace(microsecond=0)
-        time_e = time_e.replace(microsecond=0)
-
-        # unix timestamp (eg 1392577232)
-        start = int(time.mktime(time_s.timetuple()))
-        end = int(time.mktime(time_e.timetuple()))
-
-        url = self.prepare_api_url(coin, fiat, str(start), str(end))
-        response = urlopen(url)
-        prices = list(np.array(json.loads(response.read())['prices'])[:, 1])
-        n_records = len(prices)
-        delta = delta / n_records
-
-        timestamps = []
-        for i in range(1, n_records + 1):
-            timestamps.append((time_s + i * delta).replace(microsecond=0))
-
-        return prices, timestamps
+        return datetime.now(timezone.utc).replace(tzinfo=None)
 
     def plot_local_extremes(self, plot: pg.GraphicsView, times: list, prices: list):
         highest_price = np.max(prices)
@@ -245,24 +207,21 @@ class SolWatcher(form.Ui_MainWindow):
         plot.addItem(scatter)
 
     def plot_time_area(self, plot: pg.GraphicsView, df: pl.DataFrame):
-        """ Plot given DataFrame to given PyQtGraph plot """
+        """ Plot given DataFrame to given PyQtGraph plot (plot is cleared if there is no record) """
 
-        prices = list(df['price_usd'])
-        timestamps = df['time']
+        if df is None or df.height == 0:
+            plot.clear()
+            return
 
         fiat = self.display_fiat.upper()
-        if fiat != 'USD':
-            if self.exchange_rates is None:
-                self.get_exchange_data()
-            if fiat in self.exchange_rates.keys():
-                exchange_rate = self.exchange_rates[fiat]
-                for i in range(len(prices)):
-                    prices[i] *= exchange_rate
+        if fiat != 'USD' and self.exchange_rates is None:
+            self.get_exchange_data()
 
-        x_axis = []
+        # every record is converted with exchange rate of its day
+        prices = list(self.convert_prices(df, fiat))
+        timestamps = df['time']
 
-        for i in range(len(timestamps)):
-            x_axis.append(int(time.mktime(timestamps[i].timetuple())))
+        x_axis = list(timestamps.dt.epoch('s'))
 
         min_time = np.min(x_axis)
         max_time = np.max(x_axis)
@@ -286,95 +245,81 @@ class SolWatcher(form.Ui_MainWindow):
 
         plot.getPlotItem().setLimits(xMin=min_time, xMax=max_time, yMin=fill_lvl, yMax=plot_max)
 
-    def get_time_area_extremes(self, start: datetime, end: datetime, cut_area: bool,
-                               plot: pg.GraphicsView = None) -> (datetime, datetime):
-        """ Get min and max timestamps in selected time area of DataFrame
+    def collect_move_windows(self, deltas: list, end_time: datetime) -> list:
+        """
+        Collect records and statistics of more time windows ending at end_time in one query plan
 
         Args:
-            start:      start of selected area
-            end:        end of selected area
-            cut_area:   True = cut DataFrame with start&end | False = use whole DataFrame
-            plot:       Plot to visualize area in (None if no visualization)
+            deltas:     lengths of windows (each is read from the finest tier which covers it)
+            end_time:   end of all windows
 
         Out:
-            oldest:     oldest record in selected dataframe
-            latest:     latest record in selected dataframe
+            windows:    list of (records DataFrame, statistics dict) tuples
         """
-        if cut_area:
-            df_cut = self.df.filter(pl.col('time').is_between(start, end, closed="both"),)
-        else:
-            df_cut = self.df
-
-        if plot is not None:
-            self.plot_time_area(plot, df_cut)
-
-        latest = df_cut['time'].max()
-        oldest = df_cut['time'].min()
-
-        return oldest, latest
 
-    def get_time_extremes(self):
-        """ Find oldest and latest record in whole DataFrame """
+        return collect_windows(self.store, [(self.store.tier_for_window(delta), end_time - delta, end_time)
+                                            for delta in deltas])
 
-        self.oldest_record, self.latest_record = self.get_time_area_extremes(datetime.now(), datetime.now(), False,
-                                                                             self.graphicsView_at)
-        print(f"Got data between {self.oldest_record} and {self.latest_record}")
+    def get_fx_rates(self, fiat: str) -> pl.DataFrame:
+        """
+        Get exchange rates of USD to given currency over time
 
-    def get_time_diff(self) -> timedelta:
-        """ Compute time difference between current time and latest record in DataFrame
+        Args:
+            fiat:   currency code
 
         Out:
-            time_diff:  time difference between current time and latest record
+            rates:  stored daily rates, the current rate replaces rate of its day, 'time' and 'rate' columns
+                    (None if the currency is unknown)
         """
 
-        current_time = self.get_current_time()
-        self.get_time_extremes()
-        time_diff = current_time - self.latest_record
-
-        return time_diff
-
-    def refresh_dataframe(self, min_diff: int):
+        fiat = fiat.upper()
+        rates = self.service.fx.read(fiat)
+        if self.exchange_rates is None or fiat not in self.exchange_rates.keys():
+            return rates
+
+        # the current rate is fresher than the stored rate of its day
+        day = self.exchange_rates_last_update.replace(hour=0, minute=0, second=0, microsecond=0)
+        current = pl.DataFrame({'time': [day], 'rate': [float(self.exchange_rates[fiat])]},
+                               schema={'time': pl.Datetime('us'), 'rate': pl.Float64})
+        if rates is None:
+            return current
+        if rates['time'][-1] <= day:
+            return pl.concat([rates.filter(pl.col('time') < day), current])
+
+        return rates
+
+    def convert_prices(self, df: pl.DataFrame, fiat: str) -> pl.Series:
         """
-        Download the latest price data if time difference is greater than min_diff
+        Convert USD prices of records sorted by time to given currency in one columnar pass
 
         Args:
-            min_diff:   minimal time difference threshold
-        """
-
-        timediff_minutes = int(self.get_time_diff().total_seconds()) // 60
-
-        # update if time difference is greater than min_diff minutes
-        if timediff_minutes > min_diff:
-            current_time = self.get_current_time()
-            start_time = current_time - timedelta(minutes=timediff_minutes)
-            print(f"Fetching data from {start_time} to {current_time}")
-            new_prices, new_times = self.download_hist_data('solana', 'usd', start_time, current_time)
-            new_df = pl.DataFrame({'price_usd': new_prices,
-                                   'time': new_times})
-            self.df = pl.concat([self.df, new_df], how="vertical")
-            self.save_dataframe()
-        else:
-            print(f"Data are up-to-date. {timediff_minutes} minutes differance")
+            df:     records with 'time' and 'price_usd' columns
+            fiat:   currency code
 
-    def load_dataframe(self):
-        """ Load DataFrame from local file and update data if they are out-dated """
+        Out:
+            prices: converted prices (USD prices if the currency is unknown)
+        """
 
-        self.df = pl.read_json(self.df_path)
-        self.refresh_dataframe(5)
+        rates = self.get_fx_rates(fiat) if fiat.upper() != 'USD' else None
+        if rates is None:
+            return df['price_usd']
 
-    def save_dataframe(self):
-        """ Save current DataFrame to local file """
+        return to_fiat(df, rates)
 
-        self.df.write_json(self.df_path)
+    def get_exchange_data(self) -> bool:
+        """ Load current exchange rates from ExchangeRate API (False if the download failed) """
 
-    def get_exchange_data(self):
-        """ Load current exchange rates from ExchangeRate API """
+        try:
+            rates = self.http.get_json(f'{EXCHANGE_URL}/latest?base=USD')['rates']
+        except (requests.RequestException, ValueError, KeyError) as e:
+            print(f"Downloading exchange rates failed ({e})")
+            return False
 
-        response = requests.get('https://api.exchangerate.host/latest?base=USD')
-        data = response.json()
-        self.exchange_rates = data['rates']
+        self.exchange_rates = rates
         self.exchange_rates_last_update = self.get_current_time().replace(microsecond=0)
 
+        return True
+
     def load_exchange_data(self):
         """ Load exchange data from local file and update them if they are older than 1 hour """
 
@@ -386,17 +331,19 @@ class SolWatcher(form.Ui_MainWindow):
             delta = current_time - data_time
             if delta > timedelta(hours=1):
                 print(f"Exchange data are outdated ({delta}) -> Downloading new data")
-                self.get_exchange_data()
-                self.save_exchange_data()
+                if self.get_exchange_data():
+                    self.save_exchange_data()
+                    return
+                print("Using outdated local data")
             else:
                 print(f"Exchange data are up-to-date ({delta}) -> Using local data")
-                self.exchange_rates_last_update = data_time
-                self.exchange_rates = data['rates']
+            self.exchange_rates_last_update = data_time
+            self.exchange_rates = data['rates']
 
     def save_exchange_data(self):
         """ Save exchange rates to local json file """
 
-        ex_dict = {'date': int(time.mktime(self.exchange_rates_last_update.timetuple())),
+        ex_dict = {'date': calendar.timegm(self.exchange_rates_last_update.timetuple()),
                    'rates': self.exchange_rates}
         with open(self.ex_path, 'w') as outfile:
             json.dump(ex_dict, outfile)
@@ -417,7 +364,8 @@ class SolWatcher(form.Ui_MainWindow):
         elif current_idx == 4:  # All-Time
             self.label_change.setText("%.2f %%" % self.change_at)
 
-    def print_move_stats(self, delta: timedelta, end_time=None, fiat: str = 'usd', plot: pg.GraphicsView = None):
+    def print_move_stats(self, delta: timedelta, end_time=None, fiat: str = 'usd', plot: pg.GraphicsView = None,
+                         window: tuple = None):
         """
         Print stats for given time delta (current_time - delta  :  current_time)
 
@@ -425,7 +373,10 @@ class SolWatcher(form.Ui_MainWindow):
             delta:      difference between current_time and start of examined interval
             end_time:   replace current_time with that if not None
             fiat:       currency to display price in
-            plot:
+            plot:       Plot to visualize area in (None if no visualization)
+            window:     records and statistics from collect_move_windows (None = collect them now)
+
+        Data are taken from the finest storage tier which covers whole interval.
         """
         fiat = fiat.upper()
 
@@ -433,21 +384,29 @@ class SolWatcher(form.Ui_MainWindow):
             current_time = end_time
         else:
             current_time = self.get_current_time()
-        back_time = current_time - delta
-        old_time, latest_time = self.get_time_area_extremes(back_time, current_time, True, plot)
-        old_price_row = self.df.filter(pl.col('time') == old_time,)
-        new_price_row = self.df.filter(pl.col('time') == latest_time,)
-        old_price = old_price_row['price_usd'][0]
-        new_price = new_price_row['price_usd'][0]
+        if window is None:
+            window = self.collect_move_windows([delta], current_time)[0]
+        df, stats = window
+        if plot is not None:
+            self.plot_time_area(plot, df)
+        if stats is None or stats['first_price'] is None:
+            # windows which failed to download are filled by the next refresh
+            print(f"Investigating last {delta}")
+            print("  - data are missing")
+            return
+        old_price = stats['first_price']
+        new_price = stats['last_price']
 
         if end_time is None:
             self.current_usd_price = new_price
 
-        # convert to different fiat currency
-        if fiat != 'USD' and fiat in self.exchange_rates.keys():
-            print(f"1 USD = {self.exchange_rates[fiat]} {fiat}")
-            old_price *= self.exchange_rates[fiat]
-            new_price *= self.exchange_rates[fiat]
+        # convert to different fiat currency with exchange rates valid at both ends of the interval
+        if fiat != 'USD':
+            if self.exchange_rates is not None and fiat in self.exchange_rates.keys():
+                print(f"1 USD = {self.exchange_rates[fiat]} {fiat}")
+            ends = pl.DataFrame({'time': [stats['first_time'], stats['last_time']],
+                                 'price_usd': [old_price, new_price]})
+            old_price, new_price = self.convert_prices(ends, fiat).to_list()
 
         self.label_price.setText(f"%.2f {fiat}" % new_price)
 
@@ -473,15 +432,22 @@ class SolWatcher(form.Ui_MainWindow):
 class AppWindow(QMainWindow):
     def __init__(self, parent=None):
         super().__init__(parent)
-        self.ui = SolWatcher()
+        self.ui = SolWatcher(os.environ.get('SOLWATCHER_BACKEND', 'segments'),
+                             os.environ.get('SOLWATCHER_COIN', 'solana'))
         self.ui.setupUi(self)
         self.ui.init(self)
         self.ui.init_df()
         self.ui.init_exchanges()
         self.ui.init_gui()
+        self.ui.init_capture()
+        self.ui.init_live()
         # TODO: set colors
         # self.setStyleSheet("background:#999999")
 
+    def closeEvent(self, event):
+        self.ui.service.release()
+        super().closeEvent(event)
+
 
 if __name__ == '__main__':
     app = QtWidgets.QApplication(sys.argv)
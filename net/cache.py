@@ -0,0 +1,205 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+
+def normalize_url(url: str) -> str:
+    """ Normalize url so that equal requests give equal cache keys (lowercase host, sorted query) """
+
+    parts = urlsplit(url)
+    query = urlencode(sorted(parse_qsl(parts.query, keep_blank_values=True)))
+
+    return urlunsplit((parts.scheme.lower(), parts.netloc.lower(), parts.path, query, ''))
+
+
+def ttl_for(url: str) -> float:
+    """
+    Get time to live of cached response by endpoint class
+
+    Args:
+        url:    request url
+
+    Out:
+        ttl:    seconds for which cached response is served without revalidation
+    """
+
+    parts = urlsplit(url)
+    query = dict(parse_qsl(parts.query))
+
+    if parts.path.endswith("/market_chart/range") and 'to' in query:
+        # history never changes once it is old enough
+        age = time.time() - float(query['to'])
+        if age > 24 * 3600:
+            return 30 * 24 * 3600
+        if age > 3600:
+            return 3600
+        return 60
+
+    if parts.path.endswith("/latest"):
+        return 3600
+
+    if parts.path.endswith("/timeseries") and 'end_date' in query:
+        # rates of past days don't change
+        if query['end_date'] < time.strftime("%Y-%m-%d", time.gmtime(time.time() - 24 * 3600)):
+            return 30 * 24 * 3600
+        return 3600
+
+    if parts.path.endswith("/simple/price"):
+        # spot prices change every minute, processes polling at the same time share one response
+        return 30
+
+    return 300
+
+
+class ResponseCache:
+    """
+    On-disk cache of HTTP response bodies keyed by normalized url
+
+    Fresh entries (younger than TTL of their endpoint class) are served without network round trip,
+    stale entries are revalidated with ETag / Last-Modified. Total size is bounded, the least
+    recently used entries are evicted first.
+    """
+
+    def __init__(self, path: str, max_bytes: int = 64 * 1024 * 1024):
+        """
+        Args:
+            path:       cache directory
+            max_bytes:  maximal total size of cached bodies
+        """
+
+        self.path: str = path
+        self.max_bytes: int = max_bytes
+
+        self._lock = threading.Lock()
+
+        if not os.path.exists(self.path):
+            os.makedirs(self.path)
+
+    def entry_path(self, url: str) -> str:
+        """ Get path of cache entry (without extension) of given url """
+
+        return os.path.join(self.path, hashlib.sha256(normalize_url(url).encode()).hexdigest())
+
+    def lookup(self, url: str) -> dict:
+        """
+        Find cache entry of given url
+
+        Out:
+            entry:  metadata dictionary with 'fresh' flag (None if the url is not cached)
+        """
+
+        path = self.entry_path(url)
+        with self._lock:
+            try:
+                with open(path + ".json", 'r') as meta_file:
+                    entry = json.load(meta_file)
+                os.utime(path + ".body")
+            except (OSError, ValueError):
+                return None
+
+        entry['fresh'] = time.time() - entry['stored_at'] < ttl_for(url)
+
+        return entry
+
+    def body_path(self, url: str) -> str:
+        """ Get path of cached body of given url """
+
+        return self.entry_path(url) + ".body"
+
+    def read_chunks(self, url: str, chunk_size: int = 64 * 1024):
+        """ Iterate over cached body of given url in chunks """
+
+        with open(self.body_path(url), 'rb') as body_file:
+            while chunk := body_file.read(chunk_size):
+                yield chunk
+
+    @staticmethod
+    def validators(entry: dict) -> dict:
+        """ Get conditional request headers revalidating given entry """
+
+        headers = {}
+        if entry is not None and entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        if entry is not None and entry.get('last_modified'):
+            headers['If-Modified-Since'] = entry['last_modified']
+
+        return headers
+
+    def store_chunks(self, url: str, chunks, headers: dict):
+        """
+        Pass streamed response body through while saving it, entry is created only when the whole body
+        was received
+
+        Args:
+            url:        request url
+            chunks:     iterable of body chunks
+            headers:    response headers
+
+        Out:
+            iterator of the same chunks
+        """
+
+        path = self.entry_path(url)
+        temp_path = f"{path}.{threading.get_ident()}.tmp"
+        size = 0
+
+        try:
+            with open(temp_path, 'wb') as body_file:
+                for chunk in chunks:
+                    body_file.write(chunk)
+                    size += len(chunk)
+                    yield chunk
+        except BaseException:
+            os.remove(temp_path)
+            raise
+
+        entry = {'url': normalize_url(url),
+                 'stored_at': time.time(),
+                 'etag': headers.get('ETag'),
+                 'last_modified': headers.get('Last-Modified'),
+                 'size': size}
+
+        with self._lock:
+            os.replace(temp_path, path + ".body")
+            with open(path + ".json", 'w') as meta_file:
+                json.dump(entry, meta_file)
+
+        self.evict()
+
+    def refresh(self, url: str):
+        """ Mark entry as fresh again after successful revalidation """
+
+        path = self.entry_path(url)
+        with self._lock:
+            try:
+                with open(path + ".json", 'r') as meta_file:
+                    entry = json.load(meta_file)
+                entry['stored_at'] = time.time()
+                with open(path + ".json", 'w') as meta_file:
+                    json.dump(entry, meta_file)
+            except (OSError, ValueError):
+                pass
+
+    def evict(self):
+        """ Remove least recently used entries until total size fits into the limit """
+
+        with self._lock:
+            bodies = []
+            for name in os.listdir(self.path):
+                if name.endswith(".body"):
+                    stat = os.stat(os.path.join(self.path, name))
+                    bodies.append((stat.st_mtime, stat.st_size, name[:-len(".body")]))
+
+            total = sum(size for accessed, size, key in bodies)
+            for accessed, size, key in sorted(bodies):
+                if total <= self.max_bytes:
+                    break
+                for extension in (".body", ".json"):
+                    try:
+                        os.remove(os.path.join(self.path, key + extension))
+                    except OSError:
+                        pass
+                total -= size
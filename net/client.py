@@ -0,0 +1,71 @@
+import requests
+from requests.adapters import HTTPAdapter
+
+
+class HttpClient:
+    """
+    HTTP client shared by all data sources
+
+    One requests session with a connection pool, so repeated requests to the same API reuse
+    keep-alive connections instead of opening a new TCP+TLS connection every time.
+    Responses are requested gzip-compressed and every request has connect and read timeouts.
+    """
+
+    def __init__(self, pool_size: int = 8, connect_timeout: float = 5, read_timeout: float = 30):
+        """
+        Args:
+            pool_size:          number of kept connections per host
+            connect_timeout:    seconds to wait for connection
+            read_timeout:       seconds to wait for response data
+        """
+
+        self.timeout: tuple = (connect_timeout, read_timeout)
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.session.headers.update({'Accept': 'application/json',
+                                     'Accept-Encoding': 'gzip, deflate',
+                                     'User-Agent': 'SolWatcher'})
+
+    def get(self, url: str, headers: dict = None, stream: bool = False) -> requests.Response:
+        """
+        Send GET request and raise requests.HTTPError on error status
+
+        Args:
+            url:        request url
+            headers:    additional request headers
+            stream:     don't download body immediately
+
+        Out:
+            response:   received response
+        """
+
+        response = self.session.get(url, headers=headers, timeout=self.timeout, stream=stream)
+        response.raise_for_status()
+
+        return response
+
+    def get_json(self, url: str):
+        """ Send GET request and decode JSON body """
+
+        return self.get(url).json()
+
+    def close(self):
+        """ Close all pooled connections """
+
+        self.session.close()
+
+
+shared_client = None
+
+
+def get_client() -> HttpClient:
+    """ Get HTTP client shared by the whole application """
+
+    global shared_client
+    if shared_client is None:
+        shared_client = HttpClient()
+
+    return shared_client
@@ -0,0 +1,8 @@
+import os
+
+# base urls of data providers, they can point to a local replay server (net/replay.py) instead
+COINGECKO_URL = os.environ.get('SOLWATCHER_COINGECKO_URL', 'https://api.coingecko.com/api/v3').rstrip('/')
+EXCHANGE_URL = os.environ.get('SOLWATCHER_EXCHANGE_URL', 'https://api.exchangerate.host').rstrip('/')
+
+# base url of long-poll tick endpoint (None = live feed polls CoinGecko spot prices)
+LIVE_URL = os.environ.get('SOLWATCHER_LIVE_URL', '').rstrip('/') or None
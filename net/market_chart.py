@@ -0,0 +1,117 @@
+"""
+Incremental decoder of CoinGecko market_chart responses
+
+Response body looks like {"prices": [[ms, value], ...], "market_caps": [...], "total_volumes": [...]}.
+Instead of building Python lists of lists, every received chunk is cut at the last complete pair,
+brackets and commas are translated to spaces and the numbers are parsed by NumPy straight into
+float64 buffers. Only the unfinished tail of the chunk is kept between calls, so whole body never
+has to be held in memory.
+"""
+
+import re
+import numpy as np
+
+key_pattern = re.compile(rb'"(\w+)"\s*:\s*\[')
+section_end_pattern = re.compile(rb'\]\s*\]')
+separators = bytes.maketrans(b'[],', b'   ')
+
+
+class MarketChartDecoder:
+    """ Decode market_chart response fed in chunks into (times, values) arrays per series """
+
+    def __init__(self):
+        self.series: dict = {}
+
+        self._pending: bytes = b''
+        self._section: str = None
+        self._parts: list = []
+
+    @staticmethod
+    def parse_numbers(data: bytes) -> np.ndarray:
+        """ Parse complete [time, value] pairs into flat float64 array (null values become NaN) """
+
+        text = data.translate(separators).replace(b'null', b'nan').decode('ascii')
+        if text.isspace() or len(text) == 0:
+            return np.empty(0, dtype=np.float64)
+
+        return np.fromstring(text, dtype=np.float64, sep=' ')
+
+    def close_section(self):
+        """ Convert parsed numbers of current series into typed columns """
+
+        values = np.concatenate(self._parts) if self._parts else np.empty(0, dtype=np.float64)
+        if len(values) % 2 != 0:
+            raise ValueError(f"Malformed series '{self._section}' in market_chart response")
+
+        pairs = values.reshape(-1, 2)
+        self.series[self._section] = (pairs[:, 0].astype(np.int64), np.ascontiguousarray(pairs[:, 1]))
+
+        self._section = None
+        self._parts = []
+
+    def feed(self, chunk: bytes):
+        """ Decode next chunk of response body """
+
+        self._pending += chunk
+
+        while True:
+            if self._section is None:
+                match = key_pattern.search(self._pending)
+                if match is None:
+                    # keep tail which may hold beginning of next key
+                    self._pending = self._pending[-64:]
+                    return
+                self._section = match.group(1).decode('ascii')
+                self._pending = self._pending[match.end():]
+                continue
+
+            stripped = self._pending.lstrip()
+            if stripped.startswith(b']'):
+                self._pending = stripped[1:]
+                self.close_section()
+                continue
+
+            match = section_end_pattern.search(self._pending)
+            if match is not None:
+                self._parts.append(self.parse_numbers(self._pending[:match.start() + 1]))
+                self._pending = self._pending[match.end():]
+                self.close_section()
+                continue
+
+            # parse complete pairs, keep unfinished one
+            cut = self._pending.rfind(b']') + 1
+            if cut > 0:
+                self._parts.append(self.parse_numbers(self._pending[:cut]))
+                self._pending = self._pending[cut:]
+            return
+
+    def finish(self) -> dict:
+        """
+        Finish decoding
+
+        Out:
+            series:     {name: (unix ms timestamps int64 array, values float64 array)}
+        """
+
+        if self._section is not None:
+            raise ValueError(f"Truncated market_chart response (series '{self._section}' is not closed)")
+
+        return self.series
+
+
+def decode_market_chart(chunks) -> dict:
+    """
+    Decode market_chart response body
+
+    Args:
+        chunks:     iterable of body chunks (bytes)
+
+    Out:
+        series:     {name: (unix ms timestamps int64 array, values float64 array)}
+    """
+
+    decoder = MarketChartDecoder()
+    for chunk in chunks:
+        decoder.feed(chunk)
+
+    return decoder.finish()
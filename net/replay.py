@@ -0,0 +1,372 @@
+"""
+Local stand-in for CoinGecko and exchangerate.host APIs
+
+Serves market_chart/range, simple/price, /latest, /timeseries and long-poll /ticks (live feed) payloads,
+either recorded ones (response cache directory of the app, see net/cache.py) or synthetic ones, with
+configurable latency, error rate and throttling. Synthetic prices are a deterministic function of time,
+so overlapping requests agree, and their resolution follows CoinGecko auto-granularity.
+
+    python -m net.replay [--port 8765] [--latency 0.2] [--error-rate 0.05] [--throttle-rate 0.1] [--fixtures DIR]
+
+Point the app at it with
+    SOLWATCHER_COINGECKO_URL=http://127.0.0.1:8765/api/v3 SOLWATCHER_EXCHANGE_URL=http://127.0.0.1:8765
+    SOLWATCHER_LIVE_URL=http://127.0.0.1:8765/live
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlencode, urlsplit
+import numpy as np
+
+from ingest.planner import RESOLUTIONS, window_resolution
+
+# synthetic rates of /latest endpoint
+SYNTHETIC_RATES = {'USD': 1.0, 'EUR': 0.92, 'CZK': 23.1, 'GBP': 0.79, 'JPY': 149.5}
+
+
+def fixture_key(url: str) -> str:
+    """ Get provider independent key of request (path and sorted query) """
+
+    parts = urlsplit(url)
+    query = urlencode(sorted(parse_qsl(parts.query, keep_blank_values=True)))
+
+    return f"{parts.path.rstrip('/')}?{query}"
+
+
+def load_fixtures(path: str) -> dict:
+    """
+    Index recorded responses of response cache directory
+
+    Args:
+        path:       cache directory (pairs of <key>.json metadata and <key>.body files)
+
+    Out:
+        fixtures:   {request key: body path}
+    """
+
+    fixtures = {}
+    for name in os.listdir(path):
+        if not name.endswith(".json"):
+            continue
+        with open(os.path.join(path, name), 'r') as meta_file:
+            entry = json.load(meta_file)
+        fixtures[fixture_key(entry['url'])] = os.path.join(path, name[:-len(".json")] + ".body")
+
+    return fixtures
+
+
+def synthetic_series(coin: str, seconds: np.ndarray) -> tuple:
+    """
+    Get synthetic price, market cap and volume of given coin
+
+    Args:
+        coin:       CoinGecko id (selects price level)
+        seconds:    unix timestamps
+
+    Out:
+        series:     (prices, market caps, total volumes) arrays
+    """
+
+    level = 10 + int(hashlib.sha256(coin.encode()).hexdigest()[:4], 16) % 1000
+    days = seconds / 86400
+    prices = level * np.exp(0.3 * np.sin(days / 60) + 0.05 * np.sin(days * 2 * np.pi) + 0.01 * np.sin(days * 290))
+    market_caps = prices * 4e8
+    volumes = market_caps * (0.03 + 0.01 * np.sin(days / 3))
+
+    return prices, market_caps, volumes
+
+
+def synthetic_rate(currency: str, base: str, day: datetime) -> float:
+    """ Get synthetic exchange rate of given day (None for unknown currency) """
+
+    if currency.upper() not in SYNTHETIC_RATES:
+        return None
+    if currency.upper() == base.upper():
+        return 1.0
+    drift = 1 + 0.1 * np.sin(day.toordinal() / 200)
+
+    return SYNTHETIC_RATES[currency.upper()] / SYNTHETIC_RATES.get(base.upper(), 1.0) * drift
+
+
+def synthetic_market_chart(coin: str, start: int, end: int) -> bytes:
+    """
+    Generate market_chart/range payload of given coin
+
+    Args:
+        coin:   CoinGecko id (selects price level)
+        start:  unix timestamp of range start
+        end:    unix timestamp of range end
+
+    Out:
+        body:   JSON body with prices, market_caps and total_volumes
+    """
+
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    time_s = datetime.fromtimestamp(start, timezone.utc).replace(tzinfo=None)
+    time_e = datetime.fromtimestamp(end, timezone.utc).replace(tzinfo=None)
+    step = int(RESOLUTIONS[window_resolution(time_s, time_e, now)][0].total_seconds())
+
+    seconds = np.arange(-(-start // step) * step, end + 1, step, dtype=np.int64)
+    times = (seconds * 1000).tolist()
+    payload = {name: [[times[i], value] for i, value in enumerate(values.tolist())]
+               for name, values in zip(('prices', 'market_caps', 'total_volumes'), synthetic_series(coin, seconds))}
+
+    return json.dumps(payload).encode()
+
+
+def synthetic_ticks(coins: list, since: int, interval: float, wait: float, limit: int = 100) -> bytes:
+    """
+    Generate long-poll /ticks payload, request is held until a tick newer than since exists
+
+    Args:
+        coins:      CoinGecko ids
+        since:      cursor of the client in unix ms (None = only the latest tick)
+        interval:   seconds between two ticks
+        wait:       longest time to hold the request in seconds
+        limit:      maximal number of ticks per coin
+
+    Out:
+        body:       JSON body with cursor and ticks
+    """
+
+    step = int(interval * 1000)
+    deadline = time.time() + wait
+    while True:
+        latest = int(time.time() * 1000) // step * step
+        if since is None or latest > since or time.time() >= deadline:
+            break
+        time.sleep(max(min((latest + step) / 1000 - time.time(), deadline - time.time()), 0.01))
+
+    first = latest if since is None else max(since + step - since % step, latest - (limit - 1) * step)
+    seconds = np.arange(first, latest + 1, step, dtype=np.int64) / 1000
+    ticks = []
+    for coin in coins:
+        for t, price, market_cap, volume in zip(seconds.tolist(), *(values.tolist()
+                                                                   for values in synthetic_series(coin, seconds))):
+            ticks.append({'id': coin, 'time': int(t * 1000), 'price': price, 'market_cap': market_cap,
+                          'total_volume': volume})
+
+    return json.dumps({'cursor': max(latest, since or 0), 'ticks': ticks}).encode()
+
+
+def synthetic_simple_price(coins: list, fiats: list, query: dict) -> bytes:
+    """
+    Generate /simple/price payload (spot prices updated every minute)
+
+    Args:
+        coins:  CoinGecko ids
+        fiats:  currencies of prices
+        query:  other query parameters (include_market_cap, include_24hr_vol, include_last_updated_at)
+
+    Out:
+        body:   JSON body {coin: {fiat: price, ...}}
+    """
+
+    updated = int(time.time()) // 60 * 60
+    payload = {}
+    for coin in coins:
+        prices, market_caps, volumes = (values[0] for values in synthetic_series(coin, np.array([updated])))
+        entry = {}
+        for fiat in fiats:
+            rate = synthetic_rate(fiat, 'usd', datetime.now(timezone.utc).replace(tzinfo=None)) or 1.0
+            entry[fiat] = prices * rate
+            if query.get('include_market_cap') == 'true':
+                entry[f'{fiat}_market_cap'] = market_caps * rate
+            if query.get('include_24hr_vol') == 'true':
+                entry[f'{fiat}_24h_vol'] = volumes * rate
+        if query.get('include_last_updated_at') == 'true':
+            entry['last_updated_at'] = updated
+        payload[coin] = entry
+
+    return json.dumps(payload).encode()
+
+
+def synthetic_latest(base: str) -> bytes:
+    """ Generate /latest payload of exchange rates related to base currency """
+
+    today = datetime.now(timezone.utc).replace(tzinfo=None)
+    rates = {currency: synthetic_rate(currency, base, today) for currency in SYNTHETIC_RATES}
+
+    return json.dumps({'base': base.upper(), 'date': datetime.now(timezone.utc).strftime("%Y-%m-%d"),
+                       'rates': rates}).encode()
+
+
+def synthetic_timeseries(base: str, symbols: list, start: str, end: str) -> bytes:
+    """ Generate /timeseries payload of daily exchange rates between start and end day (YYYY-MM-DD) """
+
+    first = datetime.strptime(start, "%Y-%m-%d")
+    days = (datetime.strptime(end, "%Y-%m-%d") - first).days + 1
+    rates = {}
+    for i in range(max(days, 0)):
+        day = first + timedelta(days=i)
+        rates[day.strftime("%Y-%m-%d")] = {symbol: synthetic_rate(symbol, base, day)
+                                           for symbol in symbols if symbol in SYNTHETIC_RATES}
+
+    return json.dumps({'base': base.upper(), 'start_date': start, 'end_date': end, 'rates': rates}).encode()
+
+
+class ReplayServer(ThreadingHTTPServer):
+    """ Threaded HTTP server replaying provider payloads with injected latency, errors and throttling """
+
+    daemon_threads = True
+
+    def __init__(self, address: tuple = ('127.0.0.1', 8765), latency: float = 0, error_rate: float = 0,
+                 throttle_rate: float = 0, retry_after: int = 1, fixtures: str = None, seed: int = None,
+                 tick_interval: float = 5):
+        """
+        Args:
+            address:        (host, port) to listen on (port 0 = any free port)
+            latency:        seconds added to every response
+            error_rate:     probability of HTTP 500 response
+            throttle_rate:  probability of HTTP 429 response
+            retry_after:    Retry-After of throttled responses in seconds
+            fixtures:       response cache directory with recorded payloads (None = synthetic only)
+            seed:           seed of injected failures (None = random)
+            tick_interval:  seconds between two live ticks
+        """
+
+        super().__init__(address, ReplayHandler)
+
+        self.latency: float = latency
+        self.error_rate: float = error_rate
+        self.throttle_rate: float = throttle_rate
+        self.retry_after: int = retry_after
+        self.fixtures: dict = load_fixtures(fixtures) if fixtures else {}
+        self.tick_interval: float = tick_interval
+
+        self.random = random.Random(seed)
+        self.counts: dict = {'requests': 0, 200: 0, 304: 0, 404: 0, 429: 0, 500: 0}
+        self._lock = threading.Lock()
+
+    @property
+    def url(self) -> str:
+        """ Base url of the server """
+
+        host, port = self.server_address[:2]
+
+        return f"http://{host}:{port}"
+
+    def count(self, key):
+        """ Count served request or response status """
+
+        with self._lock:
+            self.counts[key] = self.counts.get(key, 0) + 1
+
+    def fault(self) -> int:
+        """ Draw injected failure status of next response (None = no failure) """
+
+        with self._lock:
+            draw = self.random.random()
+        if draw < self.throttle_rate:
+            return 429
+        if draw < self.throttle_rate + self.error_rate:
+            return 500
+
+        return None
+
+    def payload(self, path: str) -> bytes:
+        """ Get body of request path (None if the endpoint is not known) """
+
+        fixture = self.fixtures.get(fixture_key(path))
+        if fixture is not None:
+            with open(fixture, 'rb') as body_file:
+                return body_file.read()
+
+        parts = urlsplit(path)
+        query = dict(parse_qsl(parts.query))
+        segments = parts.path.strip('/').split('/')
+        if segments[-2:] == ['market_chart', 'range'] and 'coins' in segments:
+            coin = segments[segments.index('coins') + 1]
+            return synthetic_market_chart(coin, int(float(query['from'])), int(float(query['to'])))
+        if segments[-2:] == ['simple', 'price']:
+            return synthetic_simple_price(query.get('ids', '').split(','), query.get('vs_currencies', 'usd').split(','),
+                                          query)
+        if segments[-1] == 'ticks':
+            since = int(query['since']) if 'since' in query else None
+            return synthetic_ticks(query.get('ids', '').split(','), since, self.tick_interval,
+                                   float(query.get('wait', 25)))
+        if segments[-1] == 'timeseries':
+            symbols = query.get('symbols', ','.join(SYNTHETIC_RATES)).upper().split(',')
+            return synthetic_timeseries(query.get('base', 'USD'), symbols, query['start_date'], query['end_date'])
+        if segments[-1] == 'latest':
+            return synthetic_latest(query.get('base', 'USD'))
+
+        return None
+
+
+class ReplayHandler(BaseHTTPRequestHandler):
+    """ Request handler of ReplayServer """
+
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        server = self.server
+        server.count('requests')
+        if server.latency > 0:
+            time.sleep(server.latency)
+
+        status = server.fault()
+        if status is not None:
+            headers = {'Retry-After': str(server.retry_after)} if status == 429 else {}
+            return self.respond(status, json.dumps({'error': 'injected failure'}).encode(), headers)
+
+        body = server.payload(self.path)
+        if body is None:
+            return self.respond(404, json.dumps({'error': 'unknown endpoint'}).encode())
+
+        etag = '"' + hashlib.sha256(body).hexdigest()[:32] + '"'
+        if self.headers.get('If-None-Match') == etag:
+            return self.respond(304, b'', {'ETag': etag})
+
+        self.respond(200, body, {'ETag': etag})
+
+    def respond(self, status: int, body: bytes, headers: dict = None):
+        """ Send response with JSON body """
+
+        self.server.count(status)
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local stand-in for CoinGecko and exchangerate.host APIs")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latency', type=float, default=0, help="seconds added to every response")
+    parser.add_argument('--error-rate', type=float, default=0, help="probability of HTTP 500 response")
+    parser.add_argument('--throttle-rate', type=float, default=0, help="probability of HTTP 429 response")
+    parser.add_argument('--retry-after', type=int, default=1, help="Retry-After of throttled responses")
+    parser.add_argument('--fixtures', default=None, help="response cache directory with recorded payloads")
+    parser.add_argument('--seed', type=int, default=None, help="seed of injected failures")
+    parser.add_argument('--tick-interval', type=float, default=5, help="seconds between two live ticks")
+    args = parser.parse_args()
+
+    server = ReplayServer((args.host, args.port), args.latency, args.error_rate, args.throttle_rate,
+                          args.retry_after, args.fixtures, args.seed, args.tick_interval)
+    print(f"Replaying on {server.url} ({len(server.fixtures)} recorded payloads)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(f"Served {server.counts}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,249 @@
+import heapq
+import itertools
+import json
+import random
+import threading
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit
+import requests
+
+from net.cache import ResponseCache
+from net.client import HttpClient, get_client
+
+# priority classes (lower is served first)
+INTERACTIVE = 0
+BACKGROUND = 1
+
+# host: (requests per minute, burst size)
+PROVIDER_LIMITS = {
+    'api.coingecko.com': (10, 3),
+    'api.exchangerate.host': (30, 5),
+}
+DEFAULT_LIMIT = (60, 10)
+
+
+class TokenBucket:
+    """
+    Token bucket limiting request rate of one provider
+
+    Waiting requests are served by priority class and then in arrival order, so interactive requests
+    overtake queued background ones.
+    """
+
+    def __init__(self, per_minute: float, burst: int):
+        """
+        Args:
+            per_minute:     refill rate in tokens per minute
+            burst:          bucket capacity
+        """
+
+        self.rate: float = per_minute / 60
+        self.capacity: float = burst
+        self.tokens: float = burst
+        self.updated: float = time.monotonic()
+        self.blocked_until: float = 0
+
+        self._cond = threading.Condition()
+        self._waiting = []
+        self._counter = itertools.count()
+
+    def refill(self):
+        """ Add tokens for time elapsed since last refill """
+
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self, priority: int = INTERACTIVE):
+        """ Block until a token is available for request of given priority """
+
+        with self._cond:
+            ticket = (priority, next(self._counter))
+            heapq.heappush(self._waiting, ticket)
+            while True:
+                self.refill()
+                now = time.monotonic()
+                if self._waiting[0] == ticket and self.tokens >= 1 and now >= self.blocked_until:
+                    heapq.heappop(self._waiting)
+                    self.tokens -= 1
+                    self._cond.notify_all()
+                    return
+
+                if self._waiting[0] == ticket:
+                    self._cond.wait(max((1 - self.tokens) / self.rate, self.blocked_until - now, 0.01))
+                else:
+                    self._cond.wait()
+
+    def pause(self, seconds: float):
+        """ Stop issuing tokens for given time (provider asked us to slow down) """
+
+        with self._cond:
+            self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+            self.tokens = 0
+            self._cond.notify_all()
+
+
+class RequestScheduler:
+    """
+    Request scheduler keeping every provider under its rate limit
+
+    Requests wait for a token of their provider's bucket. Throttled (HTTP 429), failed (5xx) and
+    timed out requests are retried with jittered exponential backoff, honoring Retry-After.
+    JSON requests are served from response cache when possible.
+    """
+
+    def __init__(self, client: HttpClient, max_retries: int = 5, base_delay: float = 1, max_delay: float = 120,
+                 cache: ResponseCache = None):
+        """
+        Args:
+            client:         HTTP client sending the requests
+            max_retries:    number of retries before error is raised
+            base_delay:     backoff delay of the first retry in seconds
+            max_delay:      maximal backoff delay in seconds
+            cache:          response cache (None = no caching)
+        """
+
+        self.client: HttpClient = client
+        self.cache: ResponseCache = cache
+        self.max_retries: int = max_retries
+        self.base_delay: float = base_delay
+        self.max_delay: float = max_delay
+
+        self.buckets: dict = {}
+        self._lock = threading.Lock()
+
+    def bucket(self, url: str) -> TokenBucket:
+        """ Get token bucket of provider serving given url """
+
+        host = urlsplit(url).hostname
+        with self._lock:
+            if host not in self.buckets:
+                self.buckets[host] = TokenBucket(*PROVIDER_LIMITS.get(host, DEFAULT_LIMIT))
+
+            return self.buckets[host]
+
+    @staticmethod
+    def retry_after(response: requests.Response) -> float:
+        """ Get delay requested by Retry-After header in seconds (None if not present) """
+
+        value = response.headers.get('Retry-After') if response is not None else None
+        if value is None:
+            return None
+        if value.strip().isdigit():
+            return float(value)
+        try:
+            return max((parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds(), 0)
+        except (TypeError, ValueError):
+            return None
+
+    def backoff(self, attempt: int) -> float:
+        """ Get jittered exponential backoff delay of given retry """
+
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    def get(self, url: str, priority: int = INTERACTIVE, headers: dict = None,
+            stream: bool = False) -> requests.Response:
+        """
+        Send GET request once the provider's rate limit allows it, retry on throttling and server errors
+
+        Args:
+            url:        request url
+            priority:   INTERACTIVE or BACKGROUND
+            headers:    additional request headers
+            stream:     don't download body immediately
+
+        Out:
+            response:   received response
+        """
+
+        bucket = self.bucket(url)
+        attempt = 0
+        while True:
+            bucket.acquire(priority)
+            try:
+                return self.client.get(url, headers=headers, stream=stream)
+            except requests.HTTPError as error:
+                status = error.response.status_code if error.response is not None else 0
+                if (status != 429 and status < 500) or attempt >= self.max_retries:
+                    raise
+                delay = self.retry_after(error.response)
+                if delay is None:
+                    delay = self.backoff(attempt)
+                if status == 429:
+                    bucket.pause(delay)
+                print(f"Request failed with HTTP {status} -> retrying in {delay:.1f} s")
+            except (requests.ConnectionError, requests.Timeout) as error:
+                if attempt >= self.max_retries:
+                    raise
+                delay = self.backoff(attempt)
+                print(f"Request failed ({type(error).__name__}) -> retrying in {delay:.1f} s")
+
+            time.sleep(delay)
+            attempt += 1
+
+    def get_json(self, url: str, priority: int = INTERACTIVE):
+        """
+        Get decoded JSON body of url, fresh cached response is used without network round trip
+        and stale one is revalidated with conditional request
+        """
+
+        return json.loads(self.get_body(url, priority))
+
+    def get_body(self, url: str, priority: int = INTERACTIVE) -> bytes:
+        """ Get response body of url through response cache """
+
+        return b''.join(self.stream_body(url, priority))
+
+    def stream_body(self, url: str, priority: int = INTERACTIVE, chunk_size: int = 64 * 1024):
+        """
+        Iterate over response body of url in chunks, so large responses can be decoded incrementally
+
+        Fresh cached body is read from disk, otherwise received chunks are written to the cache
+        while they are passed through.
+
+        Args:
+            url:            request url
+            priority:       INTERACTIVE or BACKGROUND
+            chunk_size:     size of yielded chunks in bytes
+
+        Out:
+            iterator of body chunks
+        """
+
+        if self.cache is None:
+            with self.get(url, priority, stream=True) as response:
+                yield from response.iter_content(chunk_size)
+            return
+
+        entry = self.cache.lookup(url)
+        if entry is not None and entry['fresh']:
+            yield from self.cache.read_chunks(url, chunk_size)
+            return
+
+        with self.get(url, priority, headers=self.cache.validators(entry), stream=True) as response:
+            if response.status_code == 304 and entry is not None:
+                self.cache.refresh(url)
+                yield from self.cache.read_chunks(url, chunk_size)
+                return
+
+            yield from self.cache.store_chunks(url, response.iter_content(chunk_size), response.headers)
+
+
+shared_scheduler = None
+
+
+def get_scheduler(cache_path: str = None) -> RequestScheduler:
+    """
+    Get request scheduler shared by the whole application
+
+    Args:
+        cache_path:     directory of response cache used when the scheduler is created (None = no cache)
+    """
+
+    global shared_scheduler
+    if shared_scheduler is None:
+        shared_scheduler = RequestScheduler(get_client(), cache=ResponseCache(cache_path) if cache_path else None)
+
+    return shared_scheduler
@@ -0,0 +1,206 @@
+"""
+Compact encoding of price series
+
+Timestamps are stored as zigzag LEB128 varints of their delta-of-delta, so regularly spaced records
+take a single byte. Floats are XOR-ed with the previous value (Gorilla style), byte-shuffled and
+deflated, so slowly changing series compress well. Encoding and decoding are fully vectorized
+in NumPy and decoded columns go straight into Polars without any Python-level loop.
+
+Layout (little-endian):
+    magic       b'SWC2' (b'SWC1' frames of older versions have no time bounds)
+    n_rows      uint32
+    n_columns   uint16
+    time_min    int64   the oldest 'time' in microseconds since epoch (SWC2 only)
+    time_max    int64   the latest 'time' in microseconds since epoch (SWC2 only)
+    columns     n_columns * (name length uint16, name utf-8, kind uint8, payload length uint64, payload)
+
+Time bounds let readers skip frames outside of a queried area without decoding them.
+"""
+
+import struct
+import zlib
+import numpy as np
+import polars as pl
+
+MAGIC = b'SWC2'
+MAGIC_V1 = b'SWC1'
+KIND_TIME = 0
+KIND_FLOAT = 1
+
+header = struct.Struct('<IH')
+bounds_header = struct.Struct('<qq')
+column_header = struct.Struct('<BQ')
+
+# bytes needed to read time bounds of a frame
+BOUNDS_SIZE = len(MAGIC) + header.size + bounds_header.size
+
+
+def zigzag_encode(values: np.ndarray) -> np.ndarray:
+    """ Map signed int64 to uint64 so that small magnitudes give small numbers """
+
+    return ((values << 1) ^ (values >> 63)).view(np.uint64)
+
+
+def zigzag_decode(values: np.ndarray) -> np.ndarray:
+    """ Inverse of zigzag_encode """
+
+    return ((values >> np.uint64(1)).view(np.int64)) ^ -((values & np.uint64(1)).view(np.int64))
+
+
+def varint_encode(values: np.ndarray) -> bytes:
+    """ Encode uint64 values as LEB128 varints """
+
+    if len(values) == 0:
+        return b''
+
+    shifts = np.arange(10, dtype=np.uint64) * np.uint64(7)
+    n_bytes = 1 + (values[:, None] >= (np.uint64(1) << shifts[1:])).sum(axis=1)
+    groups = ((values[:, None] >> shifts) & np.uint64(0x7f)).astype(np.uint8)
+    positions = np.arange(10)
+    groups[positions < (n_bytes - 1)[:, None]] |= 0x80
+
+    return groups[positions < n_bytes[:, None]].tobytes()
+
+
+def varint_decode(data: bytes) -> np.ndarray:
+    """ Decode LEB128 varints into uint64 values """
+
+    raw = np.frombuffer(data, dtype=np.uint8)
+    if len(raw) == 0:
+        return np.zeros(0, dtype=np.uint64)
+
+    ends = (raw & 0x80) == 0
+    starts = np.flatnonzero(np.concatenate(([True], ends[:-1])))
+    positions = np.arange(len(raw)) - np.repeat(starts, np.diff(np.append(starts, len(raw))))
+    parts = (raw & 0x7f).astype(np.uint64) << (positions.astype(np.uint64) * np.uint64(7))
+
+    return np.add.reduceat(parts, starts)
+
+
+def encode_times(times: np.ndarray) -> bytes:
+    """ Encode int64 timestamps as delta-of-delta varints """
+
+    deltas = np.diff(times, prepend=times[:1])
+    values = np.diff(deltas, prepend=np.int64(0))
+    values[:1] = times[:1]
+
+    return varint_encode(zigzag_encode(values))
+
+
+def decode_times(data: bytes) -> np.ndarray:
+    """ Decode int64 timestamps encoded by encode_times """
+
+    values = zigzag_decode(varint_decode(data))
+    if len(values) == 0:
+        return values
+
+    deltas = np.cumsum(values[1:])
+
+    return values[0] + np.concatenate(([0], np.cumsum(deltas)))
+
+
+def encode_floats(values: np.ndarray) -> bytes:
+    """ Encode float64 values as deflated byte-shuffled XOR of neighbours """
+
+    bits = values.astype(np.float64).view(np.uint64)
+    xored = bits ^ np.concatenate(([np.uint64(0)], bits[:-1]))
+
+    return zlib.compress(xored.view(np.uint8).reshape(-1, 8).T.tobytes())
+
+
+def decode_floats(data: bytes, n_rows: int) -> np.ndarray:
+    """ Decode float64 values encoded by encode_floats """
+
+    shuffled = np.frombuffer(zlib.decompress(data), dtype=np.uint8).reshape(8, n_rows)
+    xored = np.ascontiguousarray(shuffled.T).view(np.uint64).ravel()
+
+    return np.bitwise_xor.accumulate(xored).view(np.float64)
+
+
+def encode_frame(df: pl.DataFrame) -> bytes:
+    """
+    Encode DataFrame with 'time' column and float columns
+
+    Args:
+        df:     DataFrame to encode (null floats are stored as NaN)
+
+    Out:
+        data:   encoded bytes
+    """
+
+    time_min, time_max = np.iinfo(np.int64).min, np.iinfo(np.int64).max
+    if 'time' in df.columns and df.height > 0:
+        times = df['time'].dt.epoch('us')
+        time_min, time_max = times.min(), times.max()
+
+    chunks = [MAGIC, header.pack(df.height, df.width), bounds_header.pack(time_min, time_max)]
+    for name in df.columns:
+        column = df[name]
+        if column.dtype == pl.Datetime:
+            kind = KIND_TIME
+            payload = encode_times(column.dt.epoch('us').to_numpy())
+        elif column.dtype.is_float():
+            kind = KIND_FLOAT
+            payload = encode_floats(column.fill_null(np.nan).to_numpy())
+        else:
+            raise ValueError(f"Column {name} of type {column.dtype} can't be encoded")
+
+        encoded_name = name.encode()
+        chunks += [struct.pack('<H', len(encoded_name)), encoded_name, column_header.pack(kind, len(payload)), payload]
+
+    return b''.join(chunks)
+
+
+def decode_frame(data: bytes) -> pl.DataFrame:
+    """
+    Decode DataFrame encoded by encode_frame
+
+    Args:
+        data:   encoded bytes
+
+    Out:
+        df:     decoded DataFrame
+    """
+
+    if data[:len(MAGIC)] not in (MAGIC, MAGIC_V1):
+        raise ValueError("Data are not encoded by SolWatcher codec")
+
+    offset = len(MAGIC)
+    n_rows, n_columns = header.unpack_from(data, offset)
+    offset += header.size
+    if data[:len(MAGIC)] == MAGIC:
+        offset += bounds_header.size
+
+    columns = {}
+    for i in range(n_columns):
+        name_length = struct.unpack_from('<H', data, offset)[0]
+        name = data[offset + 2:offset + 2 + name_length].decode()
+        offset += 2 + name_length
+        kind, payload_length = column_header.unpack_from(data, offset)
+        offset += column_header.size
+        payload = data[offset:offset + payload_length]
+        offset += payload_length
+
+        if kind == KIND_TIME:
+            columns[name] = pl.from_epoch(pl.Series(name, decode_times(payload)), time_unit='us')
+        else:
+            columns[name] = pl.Series(name, decode_floats(payload, n_rows), nan_to_null=True)
+
+    return pl.DataFrame(columns)
+
+
+def frame_bounds(data: bytes) -> (int, int):
+    """
+    Read time bounds from the start of encoded DataFrame (at least BOUNDS_SIZE bytes)
+
+    Out:
+        time_min:   the oldest time in microseconds since epoch (None if the frame has no bounds)
+        time_max:   the latest time in microseconds since epoch (None if the frame has no bounds)
+    """
+
+    if data[:len(MAGIC)] == MAGIC_V1:
+        return None, None
+    if data[:len(MAGIC)] != MAGIC or len(data) < BOUNDS_SIZE:
+        raise ValueError("Data are not encoded by SolWatcher codec")
+
+    return bounds_header.unpack_from(data, len(MAGIC) + header.size)
@@ -0,0 +1,91 @@
+import os
+import polars as pl
+
+from store.merge import upsert
+from store.segments import SegmentStore
+
+
+def to_fiat(df: pl.DataFrame, rates: pl.DataFrame, column: str = 'price_usd') -> pl.Series:
+    """
+    Convert USD values of records with exchange rate valid at time of each record (vectorized as-of join)
+
+    Args:
+        df:         records sorted by time with 'time' and USD value column
+        rates:      exchange rates sorted by time with 'time' and 'rate' columns (each valid until the next one)
+        column:     name of converted column
+
+    Out:
+        values:     converted values (records older than the first rate are converted with the first rate)
+    """
+
+    rates = rates.with_columns(pl.col('time').cast(df.schema['time']))
+    joined = df.select('time', column).join_asof(rates, on='time', strategy='backward')
+
+    return (joined[column] * joined['rate'].fill_null(rates['rate'][0])).alias(column)
+
+
+class FxStore:
+    """
+    Daily exchange rates of USD to other currencies, one segment store per currency
+
+    Rows hold 'time' (start of the day, naive UTC) and 'rate' (units of the currency per 1 USD).
+    """
+
+    def __init__(self, path: str):
+        """
+        Args:
+            path:   directory holding one segment store per currency
+        """
+
+        self.path: str = path
+        self.stores: dict = {}
+        self.frames: dict = {}
+
+        if not os.path.exists(self.path):
+            os.makedirs(self.path)
+
+    def store(self, currency: str) -> SegmentStore:
+        """ Get segment store of given currency """
+
+        currency = currency.upper()
+        if currency not in self.stores:
+            self.stores[currency] = SegmentStore(os.path.join(self.path, currency))
+            self.frames[currency] = self.stores[currency].read()
+
+        return self.stores[currency]
+
+    def request(self, currency: str):
+        """ Ask the writer of the store to download rates of given currency (used by processes which only read) """
+
+        self.store(currency)
+
+    def currencies(self) -> list:
+        """ List currencies with stored or requested rates """
+
+        return [name for name in sorted(os.listdir(self.path)) if os.path.isdir(os.path.join(self.path, name))]
+
+    def read(self, currency: str) -> pl.DataFrame:
+        """ Get daily rates of given currency (None if there is no stored rate) """
+
+        self.store(currency)
+        if self.frames[currency.upper()] is None:
+            # rates may have been downloaded by another process meanwhile
+            self.frames[currency.upper()] = self.stores[currency.upper()].read()
+
+        return self.frames[currency.upper()]
+
+    def latest(self, currency: str):
+        """ Get day of the latest stored rate of given currency (None if there is no stored rate) """
+
+        df = self.read(currency)
+
+        return None if df is None else df['time'].max()
+
+    def append(self, currency: str, df: pl.DataFrame):
+        """ Persist daily rates of given currency (rates of already stored days replace the old ones) """
+
+        if df is None or df.height == 0:
+            return
+
+        self.store(currency).append(df)
+        self.frames[currency.upper()] = upsert(self.frames[currency.upper()], df)
@@ -0,0 +1,53 @@
+from datetime import datetime, timedelta
+import polars as pl
+
+
+def find_gaps(times: pl.Series, cadence: timedelta, start: datetime, end: datetime, tolerance: float = 1.5) -> list:
+    """
+    Find spans between start and end where records are missing against expected cadence
+
+    Args:
+        times:      sorted record times inside the area (None = no record)
+        cadence:    expected time between consecutive records
+        start:      start of the checked area
+        end:        end of the checked area
+        tolerance:  multiple of cadence which consecutive records may be apart without forming a gap
+
+    Out:
+        gaps:       list of (start, end) tuples bounded by the records around each gap
+    """
+
+    limit = cadence * tolerance
+    if end - start <= limit:
+        return []
+    if times is None or len(times) == 0:
+        return [(start, end)]
+
+    edges = pl.concat([pl.Series([start]).cast(times.dtype), times, pl.Series([end]).cast(times.dtype)])
+    gap_ends = (edges.diff() > limit).arg_true()
+
+    return [(edges[i - 1], edges[i]) for i in gap_ends]
+
+
+def coalesce(gaps: list, max_span: timedelta) -> list:
+    """
+    Merge neighbouring gaps as long as merged span fits into one request
+
+    Re-downloading a short stretch of known records is cheaper than another rate limited request.
+
+    Args:
+        gaps:       list of (start, end) tuples sorted by time
+        max_span:   maximal span of merged gap (None = unlimited)
+
+    Out:
+        gaps:       merged list of (start, end) tuples
+    """
+
+    merged = []
+    for start, end in gaps:
+        if merged and (max_span is None or end - merged[-1][0] <= max_span):
+            merged[-1] = (merged[-1][0], end)
+        else:
+            merged.append((start, end))
+
+    return merged
@@ -0,0 +1,115 @@
+import os
+import struct
+import zlib
+import polars as pl
+
+
+class Journal:
+    """
+    Write-ahead journal of price records
+
+    Records are appended and fsync'd before they are written to the segment store and the journal
+    is cleared once the store holds them. Each record carries a CRC32 checksum, so a torn write
+    at the end of the file is detected and dropped during replay.
+
+    Record layout (little-endian):
+        n_values    uint16  number of value columns
+        crc         uint32  CRC32 of payload
+        payload     int64 time in microseconds since epoch + n_values * float64
+    """
+
+    header = struct.Struct('<HI')
+
+    def __init__(self, path: str, columns: list):
+        """
+        Args:
+            path:       journal file path
+            columns:    names of value columns (besides 'time')
+        """
+
+        self.path: str = path
+        self.columns: list = columns
+
+    def exists(self) -> bool:
+        """ Check whether the journal holds any record """
+
+        return os.path.exists(self.path) and os.path.getsize(self.path) > 0
+
+    def append(self, df: pl.DataFrame):
+        """
+        Append rows to journal and flush them to disk
+
+        Args:
+            df:     rows with 'time' column and value columns (missing values are journaled as NaN)
+        """
+
+        if df is None or df.height == 0:
+            return
+
+        payload_struct = struct.Struct(f'<q{len(self.columns)}d')
+        times = df['time'].dt.epoch('us').to_list()
+        values = df.select(pl.col(column).fill_null(float('nan')) if column in df.columns
+                           else pl.lit(float('nan')).alias(column) for column in self.columns).rows()
+
+        chunks = []
+        for i in range(len(times)):
+            payload = payload_struct.pack(times[i], *values[i])
+            chunks.append(self.header.pack(len(self.columns), zlib.crc32(payload)) + payload)
+
+        with open(self.path, 'ab') as journal_file:
+            journal_file.write(b''.join(chunks))
+            journal_file.flush()
+            os.fsync(journal_file.fileno())
+
+    def replay(self) -> pl.DataFrame:
+        """
+        Read all valid records and cut off damaged tail of the journal
+
+        Out:
+            df:     journaled rows (None if the journal is empty)
+        """
+
+        if not self.exists():
+            return None
+
+        with open(self.path, 'rb') as journal_file:
+            data = journal_file.read()
+
+        times = []
+        values = []
+        offset = 0
+        while offset + self.header.size <= len(data):
+            n_values, crc = self.header.unpack_from(data, offset)
+            payload_size = 8 + 8 * n_values
+            payload = data[offset + self.header.size:offset + self.header.size + payload_size]
+            if len(payload) < payload_size or zlib.crc32(payload) != crc:
+                break
+            record = struct.unpack(f'<q{n_values}d', payload)
+            times.append(record[0])
+            values.append(record[1:])
+            offset += self.header.size + payload_size
+
+        if offset < len(data):
+            print(f"Journal is damaged after {len(times)} records -> dropping {len(data) - offset} bytes")
+            with open(self.path, 'r+b') as journal_file:
+                journal_file.truncate(offset)
+                os.fsync(journal_file.fileno())
+
+        if len(times) == 0:
+            return None
+
+        columns = {'time': pl.from_epoch(pl.Series(times, dtype=pl.Int64), time_unit='us')}
+        for i, name in enumerate(self.columns):
+            columns[name] = [row[i] if i < len(row) else None for row in values]
+
+        df = pl.DataFrame(columns).select(self.columns + ['time'])
+
+        # missing values are journaled as NaN
+        return df.with_columns(pl.col(self.columns).cast(pl.Float64).fill_nan(None))
+
+    def clear(self):
+        """ Drop all records (after they were persisted in the store) """
+
+        with open(self.path, 'wb') as journal_file:
+            journal_file.flush()
+            os.fsync(journal_file.fileno())
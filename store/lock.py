@@ -0,0 +1,74 @@
+import os
+
+if os.name == 'nt':
+    import msvcrt
+else:
+    import fcntl
+
+
+class ProcessLock:
+    """
+    Advisory lock file marking the process which writes the store
+
+    Only one process (refresh daemon or GUI) downloads and writes at a time, the others just read.
+    The lock is held by an open file handle, so the OS releases it when the holder dies.
+    """
+
+    def __init__(self, path: str):
+        """
+        Args:
+            path:   lock file path
+        """
+
+        self.path: str = path
+        self._file = None
+
+    @property
+    def held(self) -> bool:
+        """ Check whether this process holds the lock """
+
+        return self._file is not None
+
+    def acquire(self) -> bool:
+        """
+        Try to take the lock without waiting
+
+        Out:
+            acquired:   True if this process holds the lock now
+        """
+
+        if self._file is not None:
+            return True
+
+        lock_file = open(self.path, 'a+')
+        try:
+            lock_file.seek(0)
+            if os.name == 'nt':
+                msvcrt.locking(lock_file.fileno(), msvcrt.LK_NBLCK, 1)
+            else:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return False
+
+        # pid of the holder is just informative
+        lock_file.truncate()
+        lock_file.write(str(os.getpid()))
+        lock_file.flush()
+        self._file = lock_file
+
+        return True
+
+    def release(self):
+        """ Release the lock if it is held """
+
+        if self._file is None:
+            return
+
+        self._file.seek(0)
+        if os.name == 'nt':
+            msvcrt.locking(self._file.fileno(), msvcrt.LK_UNLCK, 1)
+        else:
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+        self._file.close()
+        self._file = None
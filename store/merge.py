@@ -0,0 +1,56 @@
+import polars as pl
+
+
+def is_strictly_sorted(df: pl.DataFrame) -> bool:
+    """ Check whether records are ordered by time without duplicates """
+
+    return bool((df['time'].to_physical().diff().drop_nulls() > 0).all())
+
+
+def merge_batches(batches: list, presorted: int = 0) -> pl.DataFrame:
+    """
+    Merge batches of records into one series strictly ordered by time and free of duplicates
+
+    Everything is done in one vectorized sort, no per-record Python loop. When more batches hold
+    a record with the same time, the record from the batch later in the list wins.
+
+    Args:
+        batches:    DataFrames with 'time' column ordered from the lowest to the highest priority
+        presorted:  number of leading batches which are known to be strictly ordered already
+
+    Out:
+        df:         merged records sorted by time (None if there is no record)
+    """
+
+    ordered = [i < presorted for i, batch in enumerate(batches) if batch is not None and batch.height > 0]
+    batches = [batch for batch in batches if batch is not None and batch.height > 0]
+    if len(batches) == 0:
+        return None
+
+    # fast path - ordered batches follow each other without overlap
+    if all(batches[i]['time'][-1] < batches[i + 1]['time'][0] for i in range(len(batches) - 1)) \
+            and all(ordered[i] or is_strictly_sorted(batches[i]) for i in range(len(batches))):
+        return pl.concat(batches, how="diagonal_relaxed") if len(batches) > 1 else batches[0]
+
+    columns = list(dict.fromkeys(column for batch in batches for column in batch.columns))
+    df = pl.concat([batch.with_columns(_priority=pl.lit(i, dtype=pl.UInt32)) for i, batch in enumerate(batches)],
+                   how="diagonal_relaxed")
+
+    return (df.sort(['time', '_priority'])
+            .unique(subset='time', keep='last', maintain_order=True)
+            .select(columns))
+
+
+def upsert(df: pl.DataFrame, new_df: pl.DataFrame) -> pl.DataFrame:
+    """
+    Insert new records into DataFrame, records with already present time are replaced
+
+    Args:
+        df:         existing records strictly ordered by time (may be None)
+        new_df:     new records
+
+    Out:
+        df:         merged records sorted by time
+    """
+
+    return merge_batches([df, new_df], presorted=1)
@@ -0,0 +1,397 @@
+import os
+import struct
+import threading
+import time
+import zlib
+from datetime import datetime, timedelta
+import polars as pl
+import pyarrow as pa
+
+from store.codec import BOUNDS_SIZE, decode_frame, encode_frame, frame_bounds
+
+# errors raised by reading torn or otherwise damaged segment files
+SEGMENT_ERRORS = (OSError, ValueError, struct.error, zlib.error, pa.ArrowException, pl.exceptions.PolarsError)
+
+
+class SegmentStore:
+    """
+    Append-only columnar store kept as a directory of Arrow IPC, Parquet or compressed (store.codec) segments
+
+    Every append writes just the new rows into a new segment file, so the cost of saving is proportional
+    to the new data. Small segments are merged together by a background compaction. Arrow IPC segments
+    are stored uncompressed and memory-mapped on read, so loading is zero-copy and only pages which are
+    actually touched get read from disk.
+
+    Segment written by compaction is named seg_<number>-<first>, it replaces segments numbered from first
+    to number - 1. Replaced segments are hidden at once but removed only after retire_delay, so lazy
+    queries built before the compaction can still be collected.
+    """
+
+    prefix = "seg_"
+    suffixes = {'ipc': ".arrow", 'parquet': ".parquet", 'swc': ".swc"}
+
+    def __init__(self, path: str, max_segments: int = 16, fmt: str = 'ipc', retention: timedelta = None,
+                 compact_fmt: str = None, seal_size: int = 4 * 1024 * 1024, retire_delay: float = 60):
+        """
+        Args:
+            path:           directory holding the segment files
+            max_segments:   number of segments which triggers compaction
+            fmt:            format of newly written segments ('ipc', 'parquet' or 'swc')
+            retention:      rows older than latest record - retention are dropped by compaction (None = keep all)
+            compact_fmt:    format of segments written by compaction (None = same as fmt)
+            seal_size:      segments of at least this many bytes are not merged again by compaction
+                            (unless retention is set)
+            retire_delay:   seconds for which segments replaced by compaction stay on disk
+        """
+
+        self.path: str = path
+        self.max_segments: int = max_segments
+        self.seal_size: int = seal_size
+        self.fmt: str = fmt
+        self.compact_fmt: str = fmt if compact_fmt is None else compact_fmt
+        self.retention: timedelta = retention
+        self.retire_delay: float = retire_delay
+        self.latest = None
+
+        self._lock = threading.RLock()
+        self._compaction = None
+
+        if not os.path.exists(self.path):
+            os.makedirs(self.path)
+
+    def exists(self) -> bool:
+        """ Check whether the store holds any segment """
+
+        return len(self.segment_paths()) > 0
+
+    def list_segments(self) -> (list, list):
+        """
+        List segment files ordered from the oldest to the newest
+
+        Out:
+            live:       paths of segments holding the stored rows
+            retired:    list of (path, path of the oldest segment replacing it) tuples
+        """
+
+        names = [name for name in os.listdir(self.path)
+                 if name.startswith(self.prefix) and os.path.splitext(name)[1] in self.suffixes.values()]
+        names.sort(key=self.segment_number)
+        replacements = [(self.replaced_from(name), self.segment_number(name), name) for name in names
+                        if self.replaced_from(name) is not None]
+
+        live = []
+        retired = []
+        for name in names:
+            number = self.segment_number(name)
+            replacing = [other for first, last, other in replacements if first <= number < last]
+            if len(replacing) > 0:
+                retired.append((os.path.join(self.path, name), os.path.join(self.path, replacing[0])))
+            else:
+                live.append(os.path.join(self.path, name))
+
+        return live, retired
+
+    def segment_paths(self) -> list:
+        """ List live segment files ordered from the oldest to the newest """
+
+        return self.list_segments()[0]
+
+    def segment_number(self, name: str) -> int:
+        """ Get sequence number of segment from its file name """
+
+        return int(os.path.splitext(os.path.basename(name))[0][len(self.prefix):].split('-')[0])
+
+    def replaced_from(self, name: str) -> int:
+        """ Get number of the first segment replaced by given segment (None if it replaces none) """
+
+        parts = os.path.splitext(os.path.basename(name))[0][len(self.prefix):].split('-')
+
+        return int(parts[1]) if len(parts) > 1 else None
+
+    def mergeable_paths(self, paths: list) -> list:
+        """
+        Get segments which compaction merges: all of them if rows expire, otherwise the small segments
+        newer than the newest sealed one (merged rows must not override newer sealed rows)
+        """
+
+        if self.retention is not None:
+            return paths
+
+        first = len(paths)
+        while first > 0 and os.path.getsize(paths[first - 1]) < self.seal_size:
+            first -= 1
+
+        return paths[first:]
+
+    def new_segment_path(self, number: int, fmt: str = None, replaced_from: int = None) -> str:
+        """
+        Get path of segment with given sequence number in given format (None = current format) which replaces
+        segments from replaced_from to number - 1 (None = no segment)
+        """
+
+        fmt = self.fmt if fmt is None else fmt
+        replaced = "" if replaced_from is None else f"-{replaced_from:08d}"
+
+        return os.path.join(self.path, f"{self.prefix}{number:08d}{replaced}{self.suffixes[fmt]}")
+
+    def read(self) -> pl.DataFrame:
+        """
+        Read all segments into one DataFrame
+
+        Out:
+            df:     stored data sorted by time (None if the store is empty)
+        """
+
+        with self._lock:
+            while True:
+                paths = self.segment_paths()
+                try:
+                    frames = [frame for frame in map(self.load_segment, paths) if frame is not None]
+                    break
+                except FileNotFoundError:
+                    # segment was compacted away by writer process -> list the merged one
+                    continue
+
+        if len(frames) == 0:
+            return None
+
+        # segments written by older versions may miss some columns
+        df = pl.concat(frames, how="diagonal_relaxed", rechunk=False)
+
+        # rows upserted by newer segments replace the older ones
+        if not (df['time'].to_physical().diff().drop_nulls() > 0).all():
+            df = df.unique(subset='time', keep='last', maintain_order=True).sort('time')
+        self.latest = df['time'].max()
+
+        return df
+
+    def scan(self, start: datetime = None, end: datetime = None) -> pl.LazyFrame:
+        """
+        Lazily query all segments between start and end
+
+        Arrow IPC and Parquet segments are scanned lazily with the time filter pushed down, compressed
+        segments are decoded only if their time bounds overlap the area. Segments replaced by compaction
+        stay on disk for retire_delay, so the query can be collected after a compaction.
+
+        Args:
+            start:  start of the area (None = from the oldest record)
+            end:    end of the area (None = up to the latest record)
+
+        Out:
+            lf:     query of stored records sorted by time (None if the store is empty)
+        """
+
+        with self._lock:
+            while True:
+                paths = self.segment_paths()
+                try:
+                    frames = [lf for lf in (self.load_segment(path, self.scan_segment, start, end) for path in paths)
+                              if lf is not None]
+                    break
+                except FileNotFoundError:
+                    # segment was compacted away by writer process -> list the merged one
+                    continue
+
+        if len(frames) == 0:
+            return None
+
+        lf = pl.concat(frames, how="diagonal_relaxed")
+        if start is not None:
+            lf = lf.filter(pl.col('time') >= start)
+        if end is not None:
+            lf = lf.filter(pl.col('time') <= end)
+
+        return lf.unique(subset='time', keep='last', maintain_order=True).sort('time')
+
+    @staticmethod
+    def read_segment(path: str) -> pl.DataFrame:
+        """ Read single segment file (Arrow IPC segments are memory-mapped) """
+
+        if path.endswith(".parquet"):
+            return pl.read_parquet(path)
+        if path.endswith(".swc"):
+            with open(path, 'rb') as segment_file:
+                return decode_frame(segment_file.read())
+
+        with pa.memory_map(path, 'r') as source:
+            table = pa.ipc.open_file(source).read_all()
+
+        return pl.from_arrow(table, rechunk=False)
+
+    @staticmethod
+    def scan_segment(path: str, start: datetime = None, end: datetime = None) -> pl.LazyFrame:
+        """ Lazily scan single segment file (None if the segment is known to hold no record between start and end) """
+
+        if path.endswith(".parquet"):
+            # damaged footer fails here instead of in the query
+            pl.read_parquet_schema(path)
+            return pl.scan_parquet(path)
+        if path.endswith(".swc"):
+            with open(path, 'rb') as segment_file:
+                time_min, time_max = frame_bounds(segment_file.read(BOUNDS_SIZE))
+                if time_min is not None:
+                    epoch = datetime(1970, 1, 1)
+                    if start is not None and time_max < (start - epoch) // timedelta(microseconds=1):
+                        return None
+                    if end is not None and time_min > (end - epoch) // timedelta(microseconds=1):
+                        return None
+                segment_file.seek(0)
+                return decode_frame(segment_file.read()).lazy()
+
+        with pa.memory_map(path, 'r') as source:
+            pa.ipc.open_file(source)
+
+        return pl.scan_ipc(path)
+
+    def load_segment(self, path: str, reader=None, *args) -> pl.DataFrame:
+        """
+        Read single segment file, damaged segment (torn write) is moved aside, so it doesn't fail every load
+        and its rows get recovered by journal replay and gap fill
+
+        Args:
+            path:       segment file path
+            reader:     function(path, *args) reading the segment (None = read_segment)
+
+        Out:
+            df:         stored rows or their query (None if the segment is damaged)
+        """
+
+        try:
+            return (self.read_segment if reader is None else reader)(path, *args)
+        except FileNotFoundError:
+            raise
+        except SEGMENT_ERRORS as error:
+            print(f"Segment {path} is damaged ({error}) -> moving it aside")
+            try:
+                os.replace(path, path + ".damaged")
+            except OSError:
+                pass
+            return None
+
+    def write_segment(self, df: pl.DataFrame, path: str):
+        """ Write single segment file atomically and durably (fsync'd temporary file + rename + fsync'd directory) """
+
+        tmp_path = path + ".tmp"
+        with open(tmp_path, 'wb') as segment_file:
+            if path.endswith(".parquet"):
+                df.write_parquet(segment_file)
+            elif path.endswith(".swc"):
+                segment_file.write(encode_frame(df))
+            else:
+                df.write_ipc(segment_file, compression='uncompressed')
+            segment_file.flush()
+            os.fsync(segment_file.fileno())
+        os.replace(tmp_path, path)
+        self.sync_directory()
+
+    def sync_directory(self):
+        """ Flush renames and removals of segment files to disk """
+
+        # directories can't be opened on Windows (NTFS journals the rename itself)
+        if os.name == 'nt':
+            return
+
+        fd = os.open(self.path, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def append(self, df: pl.DataFrame):
+        """
+        Write rows to a new segment and start compaction if there are too many segments
+
+        Args:
+            df:     new rows (rows with already stored time replace the old ones)
+        """
+
+        if df is None or df.height == 0:
+            return
+
+        with self._lock:
+            paths = self.segment_paths()
+            number = self.segment_number(paths[-1]) + 1 if len(paths) > 0 else 0
+            self.write_segment(df, self.new_segment_path(number))
+            self.latest = df['time'].max() if self.latest is None else max(self.latest, df['time'].max())
+            n_segments = len(self.mergeable_paths(paths)) + 1
+
+        if n_segments > self.max_segments:
+            self.compact_async()
+
+    def replace(self, df: pl.DataFrame):
+        """
+        Replace all stored rows with given rows (new segment is written before the old ones are removed)
+
+        Args:
+            df:     new content of the store
+        """
+
+        with self._lock:
+            paths = self.segment_paths()
+            number = self.segment_number(paths[-1]) + 1 if len(paths) > 0 else 0
+            self.latest = None if df is None or df.height == 0 else df['time'].max()
+            if self.latest is None:
+                for path in paths:
+                    try:
+                        os.remove(path)
+                    except OSError:
+                        pass
+                return
+
+            self.write_segment(df, self.new_segment_path(number, replaced_from=0))
+            self.remove_retired()
+
+    def compact(self):
+        """
+        Merge small segments into a single new segment and drop rows older than retention
+
+        Segments of at least seal_size bytes (earlier compactions, large downloads) are kept as they are
+        and only the small segments appended after the newest of them are merged, so each compaction costs
+        only the recently appended data. Stores with retention stay small
+        and all their segments are merged, so expired rows get dropped. Merged segment is written before
+        the old ones are retired, so readers never miss any row.
+        """
+
+        with self._lock:
+            self.remove_retired()
+            all_paths = self.segment_paths()
+            paths = self.mergeable_paths(all_paths)
+            if len(paths) < 2:
+                return
+            frames = [frame for frame in map(self.load_segment, paths) if frame is not None]
+            if len(frames) == 0:
+                return
+            df = pl.concat(frames, how="diagonal_relaxed")
+            df = df.unique(subset='time', keep='last', maintain_order=True).sort('time')
+            if self.retention is not None:
+                df = df.filter(pl.col('time') >= df['time'].max() - self.retention)
+            self.write_segment(df, self.new_segment_path(self.segment_number(all_paths[-1]) + 1, self.compact_fmt,
+                                                         self.segment_number(paths[0])))
+
+    def remove_retired(self):
+        """
+        Remove segments replaced more than retire_delay ago (segments which are still memory-mapped elsewhere
+        on Windows are left for the next call)
+        """
+
+        now = time.time()
+        for path, replacing in self.list_segments()[1]:
+            try:
+                age = now - os.path.getmtime(replacing)
+            except OSError:
+                # replacing segment is retired and gone too
+                age = self.retire_delay
+            if age >= self.retire_delay:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+    def compact_async(self):
+        """ Run compaction in background thread (if it is not running already) """
+
+        if self._compaction is not None and self._compaction.is_alive():
+            return
+
+        self._compaction = threading.Thread(target=self.compact, daemon=True)
+        self._compaction.start()
@@ -0,0 +1,169 @@
+import sqlite3
+import threading
+from datetime import datetime
+import polars as pl
+
+from store.tiers import RAW_COLUMNS, ROLLUP_COLUMNS, TIERS, HistoryStore
+
+
+class SqliteStore(HistoryStore):
+    """
+    Tiered price history kept in embedded SQLite database
+
+    Every tier is a table with primary key (coin, time), so range queries and upserts run inside
+    the database without loading whole history into memory. The database runs in WAL mode,
+    so more processes (GUI, exporter, alert checker) can read the same history while one is writing.
+    Times are stored as microseconds since epoch.
+    """
+
+    raw_columns = [column for column in RAW_COLUMNS if column != 'time']
+    rollup_columns = [column for column in ROLLUP_COLUMNS if column != 'time']
+
+    def __init__(self, path: str, coin: str = 'solana'):
+        """
+        Args:
+            path:   database file path
+            coin:   CoinGecko id of stored cryptocurrency
+        """
+
+        self.path: str = path
+        self.coin: str = coin
+
+        self._lock = threading.Lock()
+        self.connection = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+
+        with self._lock, self.connection:
+            for tier in TIERS.keys():
+                columns = ", ".join(f"{column} REAL" for column in self.columns(tier))
+                self.connection.execute(f"CREATE TABLE IF NOT EXISTS {self.table(tier)} "
+                                        f"(coin TEXT NOT NULL, time INTEGER NOT NULL, {columns}, "
+                                        f"PRIMARY KEY (coin, time)) WITHOUT ROWID")
+
+                # tables created by older versions miss some value columns
+                present = [row[1] for row in self.connection.execute(f"PRAGMA table_info({self.table(tier)})")]
+                for column in self.columns(tier):
+                    if column not in present:
+                        self.connection.execute(f"ALTER TABLE {self.table(tier)} ADD COLUMN {column} REAL")
+
+    @staticmethod
+    def table(tier: str) -> str:
+        """ Get table name of given tier """
+
+        return f"prices_{tier}"
+
+    def columns(self, tier: str) -> list:
+        """ Get value columns of given tier """
+
+        return self.raw_columns if TIERS[tier][0] is None else self.rollup_columns
+
+    @staticmethod
+    def to_timestamp(value: datetime) -> int:
+        """ Convert datetime to stored timestamp """
+
+        return pl.Series([value]).dt.epoch('us')[0]
+
+    def query(self, sql: str, parameters: tuple = ()) -> list:
+        """ Run query and fetch all rows """
+
+        with self._lock:
+            return self.connection.execute(sql, parameters).fetchall()
+
+    def exists(self) -> bool:
+        """ Check whether any tier holds data of the coin """
+
+        return any(len(self.query(f"SELECT 1 FROM {self.table(tier)} WHERE coin = ? LIMIT 1", (self.coin,))) > 0
+                   for tier in TIERS.keys())
+
+    def load(self):
+        """ Nothing to prepare - data are queried from database on demand """
+
+        pass
+
+    def read(self, tier: str = 'raw') -> pl.DataFrame:
+        """ Get all records of given tier (None if the tier is empty) """
+
+        return self.range(tier)
+
+    def range(self, tier: str, start: datetime = None, end: datetime = None, closed: str = "both") -> pl.DataFrame:
+        """
+        Get records of given tier between start and end using the primary key index
+
+        Args:
+            tier:       name of tier
+            start:      start of the area (None = from the oldest record)
+            end:        end of the area (None = up to the latest record)
+            closed:     which bounds are included ('both', 'left', 'right' or 'none')
+
+        Out:
+            df:         records sorted by time (None if the tier is empty)
+        """
+
+        conditions = ["coin = ?"]
+        parameters = [self.coin]
+        if start is not None:
+            conditions.append("time >= ?" if closed in ("both", "left") else "time > ?")
+            parameters.append(self.to_timestamp(start))
+        if end is not None:
+            conditions.append("time <= ?" if closed in ("both", "right") else "time < ?")
+            parameters.append(self.to_timestamp(end))
+
+        columns = self.columns(tier)
+        rows = self.query(f"SELECT time, {', '.join(columns)} FROM {self.table(tier)} "
+                          f"WHERE {' AND '.join(conditions)} ORDER BY time", tuple(parameters))
+        if len(rows) == 0 and self.latest(tier) is None:
+            return None
+
+        df = pl.DataFrame(rows, schema=[('time', pl.Int64)] + [(column, pl.Float64) for column in columns],
+                          orient='row')
+
+        return df.with_columns(pl.from_epoch('time', time_unit='us')).select(columns[:1] + ['time'] + columns[1:])
+
+    def scan(self, tier: str, start: datetime = None, end: datetime = None) -> pl.LazyFrame:
+        """
+        Get lazy query of records of given tier between start and end
+
+        Bounds are applied by the database and the rows are fetched right away (views plot the whole window
+        anyway), statistics of the window are then computed in the same query plan as other stores do.
+        """
+
+        df = self.range(tier, start, end)
+
+        return None if df is None else df.lazy()
+
+    def latest(self, tier: str = 'raw'):
+        """ Get time of the latest record in given tier """
+
+        value = self.query(f"SELECT MAX(time) FROM {self.table(tier)} WHERE coin = ?", (self.coin,))[0][0]
+
+        return None if value is None else pl.from_epoch(pl.Series([value]), time_unit='us')[0]
+
+    def append(self, tier: str, df: pl.DataFrame):
+        """ Upsert rows of given tier """
+
+        columns = self.columns(tier)
+        rows = df.select(pl.lit(self.coin), pl.col('time').dt.epoch('us'), *columns).rows()
+
+        with self._lock, self.connection:
+            self.connection.executemany(f"INSERT OR REPLACE INTO {self.table(tier)} (coin, time, {', '.join(columns)}) "
+                                        f"VALUES (?, ?, {', '.join('?' * len(columns))})", rows)
+
+    def replace(self, tier: str, df: pl.DataFrame):
+        """ Replace all records of given tier """
+
+        with self._lock, self.connection:
+            self.connection.execute(f"DELETE FROM {self.table(tier)} WHERE coin = ?", (self.coin,))
+        if df is not None and df.height > 0:
+            self.append(tier, df)
+
+    def apply_retention(self):
+        """ Delete records older than retention of their tier """
+
+        with self._lock, self.connection:
+            for name, (every, source, retention) in TIERS.items():
+                if retention is None:
+                    continue
+                self.connection.execute(f"DELETE FROM {self.table(name)} WHERE coin = ? AND time < "
+                                        f"(SELECT MAX(time) FROM {self.table(name)} WHERE coin = ?) - ?",
+                                        (self.coin, self.coin, int(retention.total_seconds() * 1e6)))
@@ -0,0 +1,59 @@
+import polars as pl
+
+
+def window_stats(lf: pl.LazyFrame) -> pl.LazyFrame:
+    """
+    Build query of first/last records and price extremes of records sorted by time
+
+    Args:
+        lf:     records with 'time' and 'price_usd' columns (rollups may have 'low' and 'high' too)
+
+    Out:
+        lf:     one row query with count, first_time, first_price, last_time, last_price,
+                lowest_time, lowest_price, highest_time and highest_price columns
+    """
+
+    columns = lf.collect_schema().names()
+    low = 'low' if 'low' in columns else 'price_usd'
+    high = 'high' if 'high' in columns else 'price_usd'
+
+    return lf.select(pl.len().alias('count'),
+                     pl.col('time').first().alias('first_time'),
+                     pl.col('price_usd').first().alias('first_price'),
+                     pl.col('time').last().alias('last_time'),
+                     pl.col('price_usd').last().alias('last_price'),
+                     pl.col('time').gather(pl.col(low).arg_min()).first().alias('lowest_time'),
+                     pl.col(low).min().alias('lowest_price'),
+                     pl.col('time').gather(pl.col(high).arg_max()).first().alias('highest_time'),
+                     pl.col(high).max().alias('highest_price'))
+
+
+def collect_windows(store, windows: list) -> list:
+    """
+    Collect records and statistics of more time windows as one parallel query plan
+
+    Args:
+        store:      HistoryStore to scan
+        windows:    list of (tier, start, end) tuples
+
+    Out:
+        results:    list of (records DataFrame, statistics dict) tuples, (None, None) for empty tiers
+    """
+
+    scans = [store.scan(tier, start, end) for tier, start, end in windows]
+    queries = []
+    for lf in scans:
+        if lf is not None:
+            queries += [lf, window_stats(lf)]
+
+    frames = iter(pl.collect_all(queries))
+
+    results = []
+    for lf in scans:
+        if lf is None:
+            results.append((None, None))
+        else:
+            df = next(frames)
+            results.append((df, next(frames).row(0, named=True)))
+
+    return results
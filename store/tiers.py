@@ -0,0 +1,271 @@
+import os
+from abc import ABC, abstractmethod
+from datetime import datetime, timedelta
+import polars as pl
+
+from store.merge import merge_batches, upsert
+from store.segments import SegmentStore
+from store.timeindex import local_to_utc, time_slice
+
+# name: (rollup interval, source tier, retention) ordered from the finest to the coarsest tier
+TIERS = {
+    'raw': (None, None, timedelta(days=2)),
+    '5m': ('5m', 'raw', timedelta(days=8)),
+    '1h': ('1h', '5m', None),
+    '1d': ('1d', '1h', None),
+}
+
+# longest time window read from each tier, every view reads the finest tier which covers it
+# (in-memory frames keep just this much even when the tier is kept forever on disk)
+WINDOW_LIMITS = {'raw': timedelta(days=2), '5m': timedelta(days=8), '1h': timedelta(days=400), '1d': None}
+
+# stored columns of raw and rollup tiers, market cap and 24h volume are in USD as well
+RAW_COLUMNS = ['price_usd', 'time', 'market_cap', 'total_volume']
+ROLLUP_COLUMNS = ['price_usd', 'time', 'open', 'high', 'low', 'market_cap', 'total_volume']
+
+
+def conform(df: pl.DataFrame, columns: list) -> pl.DataFrame:
+    """ Select columns in given order, missing value columns (records of older versions) are filled with nulls """
+
+    missing = [pl.lit(None, dtype=pl.Float64).alias(column) for column in columns if column not in df.columns]
+
+    return df.with_columns(missing).select(columns)
+
+
+def rollup(df: pl.DataFrame, every: str) -> pl.DataFrame:
+    """
+    Downsample records to buckets of given interval
+
+    Args:
+        df:     records with 'time', 'price_usd', 'open', 'high', 'low', 'market_cap' and 'total_volume' columns
+        every:  bucket interval (eg. '5m', '1h', '1d')
+
+    Out:
+        df:     one row per bucket, 'price_usd' holds the close price, market cap and 24h volume
+                are the last known values in the bucket
+    """
+
+    return (df.sort('time')
+            .group_by_dynamic('time', every=every)
+            .agg(pl.col('price_usd').last(),
+                 pl.col('open').first(),
+                 pl.col('high').max(),
+                 pl.col('low').min(),
+                 pl.col('market_cap').drop_nulls().last(),
+                 pl.col('total_volume').drop_nulls().last())
+            .select(ROLLUP_COLUMNS))
+
+
+class HistoryStore(ABC):
+    """
+    Base of storage backends keeping price history in several resolution tiers
+
+    Raw ticks are downsampled to 5 minute, hourly and daily OHLC rollups as they are ingested and
+    each tier has its own retention. Backends implement reading and writing of single tiers.
+    """
+
+    @abstractmethod
+    def exists(self) -> bool:
+        """ Check whether any tier holds data """
+
+    @abstractmethod
+    def load(self):
+        """ Prepare stored data for reading """
+
+    @abstractmethod
+    def read(self, tier: str = 'raw') -> pl.DataFrame:
+        """ Get all records of given tier (None if the tier is empty) """
+
+    @abstractmethod
+    def range(self, tier: str, start: datetime = None, end: datetime = None, closed: str = "both") -> pl.DataFrame:
+        """ Get records of given tier between start and end (None if the tier is empty) """
+
+    @abstractmethod
+    def scan(self, tier: str, start: datetime = None, end: datetime = None) -> pl.LazyFrame:
+        """ Get lazy query of records of given tier between start and end (None if the tier is empty) """
+
+    @abstractmethod
+    def latest(self, tier: str = 'raw'):
+        """ Get time of the latest record in given tier """
+
+    @abstractmethod
+    def append(self, tier: str, df: pl.DataFrame):
+        """ Upsert rows of given tier """
+
+    @abstractmethod
+    def replace(self, tier: str, df: pl.DataFrame):
+        """ Replace all records of given tier """
+
+    @abstractmethod
+    def apply_retention(self):
+        """ Drop records older than retention of their tier """
+
+    @staticmethod
+    def tier_for_window(delta: timedelta) -> str:
+        """ Get the finest tier which serves time window of given length """
+
+        for name, limit in WINDOW_LIMITS.items():
+            if limit is None or limit >= delta:
+                return name
+
+    def ingest(self, df: pl.DataFrame):
+        """
+        Store raw records and update rollups of all buckets they touch
+
+        Args:
+            df:     raw records with 'price_usd' and 'time' columns (and optional 'market_cap' and 'total_volume')
+        """
+
+        if df is None or df.height == 0:
+            return
+
+        df = conform(merge_batches([df]), RAW_COLUMNS)
+        self.append('raw', df)
+        start = df['time'].min()
+        end = df['time'].max()
+
+        for name, (every, source, retention) in TIERS.items():
+            if every is None:
+                continue
+
+            bucket_start = pl.Series([start]).dt.truncate(every)[0]
+            bucket_end = pl.Series([end]).dt.truncate(every).dt.offset_by(every)[0]
+            source_df = self.range(source, bucket_start, bucket_end, closed="left")
+            if source == 'raw':
+                source_df = source_df.with_columns(open=pl.col('price_usd'), high=pl.col('price_usd'),
+                                                   low=pl.col('price_usd'))
+
+            rollup_df = rollup(source_df, every)
+            self.append(name, rollup_df)
+            start = rollup_df['time'].min()
+            end = rollup_df['time'].max()
+
+        self.apply_retention()
+
+    def convert_local_time(self):
+        """
+        Shift records stored in local time by older versions to UTC
+
+        Raw records are shifted, rollups are computed again from the shifted finer tier where it reaches
+        (buckets keep their alignment), older rollups are moved to the nearest bucket.
+        """
+
+        converted = {}
+        for name, (every, source, retention) in TIERS.items():
+            lf = self.scan(name)
+            if lf is None:
+                converted[name] = None
+                continue
+
+            df = lf.collect()
+            df = df.with_columns(local_to_utc(df['time']))
+            if every is not None:
+                df = merge_batches([conform(df.with_columns(pl.col('time').dt.round(every)), ROLLUP_COLUMNS)])
+                source_df = converted[source]
+                if source_df is not None:
+                    if source == 'raw':
+                        source_df = source_df.with_columns(open=pl.col('price_usd'), high=pl.col('price_usd'),
+                                                           low=pl.col('price_usd'))
+                    # bucket holding the first source record may be incomplete
+                    rolled = rollup(source_df, every).filter(pl.col('time') >= source_df['time'].min())
+                    df = upsert(df, rolled)
+            else:
+                df = merge_batches([df])
+
+            converted[name] = df
+            self.replace(name, df)
+
+
+class TieredStore(HistoryStore):
+    """
+    Tiered price history kept in segment stores (one per tier) and in memory
+
+    Memory and plotting cost stay bounded by tier retention and window limits no matter how long the history is.
+    Fresh segments are memory-mapped Arrow IPC, compacted history is stored compressed.
+    """
+
+    def __init__(self, path: str):
+        """
+        Args:
+            path:   directory holding one segment store per tier
+        """
+
+        self.path: str = path
+        self.stores: dict = {}
+        self.frames: dict = {}
+
+        for name, (every, source, retention) in TIERS.items():
+            self.stores[name] = SegmentStore(os.path.join(self.path, name), retention=retention, compact_fmt='swc')
+            self.frames[name] = None
+
+    def exists(self) -> bool:
+        """ Check whether any tier holds data """
+
+        return any(store.exists() for store in self.stores.values())
+
+    def load(self):
+        """ Read all tiers from disk """
+
+        for name, (every, source, retention) in TIERS.items():
+            frame = self.stores[name].read()
+            if frame is not None:
+                frame = conform(frame, RAW_COLUMNS if every is None else ROLLUP_COLUMNS)
+            self.frames[name] = frame
+
+        self.apply_retention()
+
+    def read(self, tier: str = 'raw') -> pl.DataFrame:
+        """ Get in-memory DataFrame of given tier (None if the tier is empty) """
+
+        return self.frames[tier]
+
+    def range(self, tier: str, start: datetime = None, end: datetime = None, closed: str = "both") -> pl.DataFrame:
+        """ Get slice of in-memory DataFrame of given tier between start and end """
+
+        if self.frames[tier] is None:
+            return None
+
+        return time_slice(self.frames[tier], start, end, closed)
+
+    def scan(self, tier: str, start: datetime = None, end: datetime = None) -> pl.LazyFrame:
+        """
+        Get lazy scan of on-disk segments of given tier with time bounds pushed down, records older than
+        retention of the tier are left out (disk is trimmed by compaction only)
+        """
+
+        retention = TIERS[tier][2]
+        latest = self.stores[tier].latest
+        if retention is not None and latest is not None:
+            start = latest - retention if start is None else max(start, latest - retention)
+
+        return self.stores[tier].scan(start, end)
+
+    def latest(self, tier: str = 'raw'):
+        """ Get time of the latest record in given tier """
+
+        return self.stores[tier].latest
+
+    def append(self, tier: str, df: pl.DataFrame):
+        """ Persist rows of given tier and merge them into its in-memory DataFrame """
+
+        self.stores[tier].append(df)
+        self.frames[tier] = upsert(self.frames[tier], df)
+
+    def replace(self, tier: str, df: pl.DataFrame):
+        """ Replace all persisted records of given tier and its in-memory DataFrame """
+
+        self.stores[tier].replace(df)
+        self.frames[tier] = df
+
+    def apply_retention(self):
+        """
+        Drop in-memory records older than retention of their tier (disk is trimmed by compaction) or older
+        than the longest window read from the tier
+        """
+
+        for name, (every, source, retention) in TIERS.items():
+            frame = self.frames[name]
+            retention = WINDOW_LIMITS[name] if retention is None else retention
+            if retention is None or frame is None:
+                continue
+            self.frames[name] = frame.slice(frame['time'].search_sorted(frame['time'].max() - retention))
@@ -0,0 +1,50 @@
+import calendar
+import time
+from datetime import datetime
+import polars as pl
+
+
+def time_slice(df: pl.DataFrame, start: datetime = None, end: datetime = None, closed: str = "both") -> pl.DataFrame:
+    """
+    Cut records between start and end from DataFrame sorted by time
+
+    Bounds are found by binary search, so the cost is O(log n) and the result is a zero-copy slice.
+
+    Args:
+        df:         DataFrame sorted by 'time' column
+        start:      start of the area (None = from the oldest record)
+        end:        end of the area (None = up to the latest record)
+        closed:     which bounds are included ('both', 'left', 'right' or 'none')
+
+    Out:
+        df:         records inside the area
+    """
+
+    times = df['time']
+    lo = 0 if start is None else times.search_sorted(start, side='left' if closed in ("both", "left") else 'right')
+    hi = df.height if end is None else times.search_sorted(end, side='right' if closed in ("both", "right") else 'left')
+
+    return df.slice(lo, max(hi - lo, 0))
+
+
+def local_to_utc(times: pl.Series) -> pl.Series:
+    """
+    Convert naive local times (records of older versions) to naive UTC
+
+    UTC offset is looked up once per distinct hour, so daylight saving changes are respected.
+
+    Args:
+        times:  naive Datetime series in local time of this machine
+
+    Out:
+        times:  naive Datetime series in UTC
+    """
+
+    hours = times.dt.truncate('1h')
+    distinct = hours.unique().drop_nulls()
+    offsets = [calendar.timegm(hour.timetuple()) - int(time.mktime(hour.timetuple())) for hour in distinct.to_list()]
+    lookup = pl.DataFrame({'hour': distinct, 'offset': pl.Series(offsets, dtype=pl.Int64)})
+    offset = pl.DataFrame({'hour': hours}).join(lookup, on='hour', how='left', maintain_order='left')['offset']
+
+    # offset is local time - UTC
+    return (times.dt.epoch('us') - offset * 1_000_000).cast(pl.Datetime('us')).alias(times.name)